@@ -2,17 +2,24 @@ import json
 from pathlib import Path
 import sys
 import click
+from contextlib import nullcontext
 import logging
 import datetime
 
 from windows_toasts import Toast
 
 
-from models.course import Course
+from models.daemon_client import DaemonClient, RunStatus, absolute_recipe_paths
 from models.notification import get_windows_toaster
-from models.recipe import Recipe, RecipeMetadata
 from models.store import load_recipe_from_store, load_recipe_store
 
+# The recipe, course and daemon modules import Playwright and pydantic, they are
+# imported by the commands needing them so a recipe submitted to the daemon
+# doesn't pay for them
+
+# `models.course.ErrorPolicy` values
+ERROR_POLICIES = ["fail-fast", "continue"]
+
 
 class LogLevel(click.ParamType):
     name = "loglevel"
@@ -33,11 +40,18 @@ class LogLevel(click.ParamType):
 @click.option(
     "--log-level", "-v", default="INFO", help="Logging level.", type=LogLevel()
 )
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(),
+    help="Write a Chrome trace of the run timings to this JSON file.",
+)
 @click.pass_context
 def main(
     ctx: click.Context = None,
     log_path: Path | None = None,
     log_level: str = "INFO",
+    profile_path: Path | None = None,
 ):
     click.echo("Welcome to HomeCook!")
     click.echo("================================")
@@ -56,24 +70,51 @@ def main(
             )
         )
 
-    ctx.obj = {"logger": logger}
+    ctx.obj = {"logger": logger, "log_path": log_path}
+
+    store_load = nullcontext()
 
-    load_recipe_store(logger=logger)
+    if profile_path:
+        from models.profiler import enable_profiler, profile
+
+        profiler = enable_profiler()
+        store_load = profile("store load", "load")
+
+        def export_profile():
+            profiler.export(profile_path)
+            logger.info(profiler.summary())
+            logger.info(f"Profile written to: {profile_path}")
+
+        ctx.call_on_close(export_profile)
+
+    with store_load:
+        load_recipe_store(logger=logger)
 
 
 @main.command()
 @click.option("--key", "-k", help="Key of the recipe to use")
 @click.option("--recipe-file", "-f", type=click.Path(), help="Path to the recipe file.")
 @click.option("--config-file", "-c", type=click.Path(), help="Path to the config file.")
+@click.option("--resume", "-r", help="Run id of a failed run to resume.")
+@click.option(
+    "--no-daemon",
+    is_flag=True,
+    default=False,
+    help="Cook in this process even if a HomeCook daemon is running.",
+)
 @click.pass_context
 def single_dish(
     context: click.Context,
     key: str | None = None,
     recipe_file: Path | None = None,
     config_file: Path | None = None,
+    resume: str | None = None,
+    no_daemon: bool = False,
 ):
-    if not key and not recipe_file:
-        raise ValueError("single_dish must have either key or recipe file to run.")
+    if not key and not recipe_file and not resume:
+        raise ValueError(
+            "single_dish must have either key, recipe file or run id to resume."
+        )
 
     click.echo("Serving a single dish...")
 
@@ -82,29 +123,141 @@ def single_dish(
     logger: logging.Logger = context.obj["logger"]
     logger = logger.getChild("single_dish_logger")
 
-    if key:
-        recipe_data = json.loads(load_recipe_from_store(key))
-        recipe = Recipe.from_dict(recipe_data, logger=logger, config_path=config_file)
+    # Resumed runs stay local, their checkpoint lives in this process's store
+    daemon = None if no_daemon or resume else DaemonClient.discover()
+
+    if daemon:
+        # The daemon loads and validates the recipe, the client only sends it
+        recipe_data = load_recipe_data(key, recipe_file, config_file)
+        name = recipe_data.get("metadata", {}).get("name")
     else:
-        logger.info(f"Using recipe file: {recipe_file}")
-        recipe = Recipe.from_json(recipe_file, config_path=config_file, logger=logger)
+        from models.checkpoint import Checkpoint
+        from models.recipe import Recipe
 
-        logger.info(
-            f"Recipe '{recipe.metadata.name}' (version {recipe.metadata.version}) loaded."
-        )
+        checkpoint: Checkpoint | None = None
+
+        if resume:
+            checkpoint = Checkpoint.load(resume)
+            recipe = Recipe.from_dict(checkpoint.recipe, logger=logger)
+
+            logger.info(
+                f"Resuming run '{resume}' from step {(checkpoint.failed_step or 0) + 1}."
+            )
+        else:
+            if recipe_file:
+                logger.info(f"Using recipe file: {recipe_file}")
+
+            recipe = Recipe.from_dict(
+                load_recipe_data(key, recipe_file, config_file), logger=logger
+            )
+
+            logger.info(
+                f"Recipe '{recipe.metadata.name}' (version {recipe.metadata.version}) loaded."
+            )
+
+        name = recipe.metadata.name
 
     toaster.show_toast(Toast(["Begin cooking"]))
     try:
-        recipe.cook()
+        if daemon:
+            cook_on_daemon(daemon, recipe_data, logger)
+        else:
+            recipe.cook(resume=checkpoint)
     except Exception as e:
-        toaster.show_toast(
-            Toast([f"Cooking failed for recipe: {recipe.metadata.name}"])
-        )
+        toaster.show_toast(Toast([f"Cooking failed for recipe: {name}"]))
         raise e
 
     toaster.show_toast(Toast(["Cooking finished"]))
 
 
+def load_recipe_data(
+    key: str | None, recipe_file: Path | None, config_file: Path | None
+) -> dict[str, any]:
+    """
+    The raw recipe of the store `key` or of `recipe_file`, with the config of
+    `config_file` when given.
+    """
+    if key:
+        recipe_data = json.loads(load_recipe_from_store(key))
+    else:
+        with open(recipe_file, "r") as f:
+            recipe_data = json.load(f)
+
+    if config_file:
+        with open(config_file, "r") as f:
+            recipe_data["config"] = json.load(f)
+
+    if recipe_data.get("config") is None:
+        raise ValueError("No config provided.")
+
+    return recipe_data
+
+
+def cook_on_daemon(
+    daemon: DaemonClient, recipe_data: dict[str, any], logger: logging.Logger
+):
+    # The daemon runs from its own working directory
+    absolute_recipe_paths(recipe_data, Path.cwd())
+
+    run = daemon.submit(recipe_data)
+    logger.info(f"Recipe submitted to the HomeCook daemon as run {run['run_id']}")
+
+    run = daemon.wait(run["run_id"], on_log=logger.info)
+
+    if run["status"] != RunStatus.SUCCEEDED.value:
+        raise click.ClickException(f"Run {run['run_id']} failed: {run['error']}")
+
+
+@main.command()
+@click.option("--port", type=int, default=0, help="Port to listen on. Default: any.")
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    default=2,
+    help="Number of recipes cooked at the same time.",
+)
+@click.option(
+    "--max-queue",
+    type=int,
+    default=100,
+    help="Number of queued recipes above which submissions are refused.",
+)
+@click.pass_context
+def serve(context: click.Context, port: int, workers: int, max_queue: int):
+    click.echo("Serving recipes from a warm kitchen...")
+
+    from models.daemon import Daemon, DaemonConfig
+
+    logger: logging.Logger = context.obj["logger"]
+    logger = logger.getChild("daemon_logger")
+
+    if DaemonClient.discover():
+        raise click.ClickException("A HomeCook daemon is already running.")
+
+    daemon = Daemon(
+        DaemonConfig(port=port, workers=workers, max_queue=max_queue), logger=logger
+    )
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("HomeCook daemon stopped")
+
+
+@main.command()
+def status():
+    """
+    Show the queue depth, concurrency and runs of the HomeCook daemon.
+    """
+    daemon = DaemonClient.discover()
+
+    if daemon is None:
+        raise click.ClickException("No HomeCook daemon is running.")
+
+    click.echo(json.dumps(daemon.status(), indent=4))
+
+
 @main.command()
 @click.option(
     "--menu-file",
@@ -112,11 +265,56 @@ def single_dish(
     type=click.Path(exists=True),
     help="Path to the courses directory.",
 )
+@click.option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    default=False,
+    help="Cook the recipes concurrently on an asyncio event loop.",
+)
+@click.option(
+    "--parallel",
+    "-p",
+    type=int,
+    default=0,
+    help="Number of recipes cooked at the same time (worker processes, or "
+    "concurrent browser contexts with --async).",
+)
+@click.option(
+    "--on-error",
+    type=click.Choice(ERROR_POLICIES),
+    default=ERROR_POLICIES[0],
+    help="Whether a failing recipe cancels the others in parallel modes.",
+)
+@click.option(
+    "--lazy",
+    is_flag=True,
+    default=False,
+    help="Load each recipe when it is about to be cooked instead of all upfront.",
+)
+@click.option(
+    "--validate",
+    is_flag=True,
+    default=False,
+    help="Check that every recipe loads before cooking any of them.",
+)
 @click.pass_context
 def multi_courses(
     context: click.Context,
     menu_file: Path,
+    use_async: bool = False,
+    parallel: int = 0,
+    on_error: str = ERROR_POLICIES[0],
+    lazy: bool = False,
+    validate: bool = False,
 ):
+    from models.course import (
+        Course,
+        ErrorPolicy,
+        RecipeStatus,
+        format_results_summary,
+    )
+
     click.echo("Serving multiple courses...")
     toaster = get_windows_toaster()
 
@@ -125,11 +323,50 @@ def multi_courses(
 
     logger.info(f"Using menu file: {menu_file}")
 
-    course = Course.from_menu_file(menu_file, logger=logger)
+    course = Course.from_menu_file(
+        menu_file, logger=logger, lazy=lazy, validate=validate
+    )
+
+    logger.info(f"Course '{course.title}' loaded with {course.recipe_count} recipes.")
 
-    logger.info(f"Course '{course.title}' loaded with {len(course.recipes)} recipes.")
+    log_dir: Path | None = context.obj["log_path"]
+    on_error = ErrorPolicy(on_error)
 
-    course.execute_all_recipes(toaster=toaster)
+    if use_async:
+        import asyncio
+
+        results = asyncio.run(
+            course.execute_all_recipes_async(
+                toaster=toaster,
+                max_concurrency=parallel or None,
+                on_error=on_error,
+                log_dir=log_dir,
+                log_level=logger.getEffectiveLevel(),
+            )
+        )
+    elif parallel > 1:
+        results = course.execute_all_recipes_parallel(
+            toaster=toaster,
+            max_workers=parallel,
+            on_error=on_error,
+            log_dir=log_dir,
+            log_level=logger.getEffectiveLevel(),
+        )
+    else:
+        course.execute_all_recipes(toaster=toaster)
+        results = None
+
+    if results is not None:
+        logger.info(format_results_summary(results))
+
+        failed = [
+            result for result in results if result.status != RecipeStatus.SUCCEEDED
+        ]
+        if failed:
+            toaster.show_toast(
+                Toast(["Course failed", f"{len(failed)} recipes did not finish"])
+            )
+            raise click.ClickException(f"{len(failed)} recipes did not finish.")
 
     logger.info("All recipes finished cooking")
     logger.info("Course completed")
@@ -158,6 +395,8 @@ def utensil():
     help="Store the sample recipe in the recipe store.",
 )
 def create_sample_recipe(output_file: Path, store_recipe: bool):
+    from models.recipe import Recipe
+
     sample_recipe = Recipe.create_template_file()
     click.echo("Create sample recipe JSON at: " + str(output_file))
 
@@ -190,6 +429,8 @@ def create_sample_recipe(output_file: Path, store_recipe: bool):
     help="Output path for the sample course JSON.",
 )
 def create_sample_course(output_file: Path):
+    from models.course import Course
+
     click.echo("Create sample course JSON at: " + str(output_file))
 
     Path(output_file).parent.mkdir(parents=True, exist_ok=True)
@@ -209,6 +450,7 @@ def create_sample_course(output_file: Path):
     help="Path to the recipe file to add to the store.",
 )
 def add_recipe_to_store(recipe_file: Path):
+    from models.recipe import RecipeMetadata
     from models.store import add_recipe_to_store
 
     if not recipe_file.exists() or not recipe_file.is_file():
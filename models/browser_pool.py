@@ -0,0 +1,258 @@
+import time
+from contextlib import asynccontextmanager, contextmanager
+from logging import Logger, getLogger
+from typing import Self
+
+from playwright.async_api import Browser as AsyncBrowser
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.sync_api import Browser, BrowserContext
+from pydantic import BaseModel
+
+from models.profiler import profile
+
+
+class BrowserPoolConfig(BaseModel):
+    max_size: int = 1  # browsers kept open at the same time
+    max_uses: int = 20  # contexts handed out before a browser is recycled
+    idle_timeout: int = 300  # in seconds
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {"max_size": 1, "max_uses": 20, "idle_timeout": 300}
+
+
+class PooledBrowser:
+    def __init__(self, browser: Browser | AsyncBrowser, headless: bool):
+        self.browser = browser
+        self.headless = headless
+        self.uses = 0
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class _BrowserPoolBase:
+    """
+    Bookkeeping shared by the sync and async pools. Browsers are picked per
+    headless mode, recycled after `max_uses` contexts and closed once they have
+    been idle for `idle_timeout` seconds or the pool holds more than `max_size`.
+    """
+
+    def __init__(
+        self, config: BrowserPoolConfig | None = None, logger: Logger | None = None
+    ):
+        self.config = config if config else BrowserPoolConfig()
+        self.logger = logger if logger else getLogger("BrowserPoolLogger")
+        self.browsers: list[PooledBrowser] = []
+
+    def _pick(self, headless: bool) -> PooledBrowser | None:
+        """
+        Return the browser to open the next context in, or None when a new
+        browser should be launched.
+        """
+        candidates = [
+            browser
+            for browser in self.browsers
+            if browser.headless == headless and browser.uses < self.config.max_uses
+        ]
+
+        if not candidates:
+            return None
+
+        candidate = min(candidates, key=lambda browser: browser.in_use)
+
+        if candidate.in_use > 0 and len(self.browsers) < self.config.max_size:
+            return None
+
+        return candidate
+
+    def _acquire(self, browser: PooledBrowser) -> None:
+        browser.uses += 1
+        browser.in_use += 1
+        browser.last_used = time.monotonic()
+
+    def _release(self, browser: PooledBrowser) -> None:
+        browser.in_use -= 1
+        browser.last_used = time.monotonic()
+
+    def _to_close(self) -> list[PooledBrowser]:
+        """
+        Remove and return the idle browsers that are worn out, expired or over
+        the pool size.
+        """
+        now = time.monotonic()
+        idle = [browser for browser in self.browsers if browser.in_use == 0]
+        to_close: list[PooledBrowser] = []
+
+        for browser in sorted(idle, key=lambda browser: browser.last_used):
+            if (
+                browser.uses >= self.config.max_uses
+                or now - browser.last_used > self.config.idle_timeout
+                or len(self.browsers) - len(to_close) > self.config.max_size
+            ):
+                to_close.append(browser)
+
+        for browser in to_close:
+            self.browsers.remove(browser)
+
+        return to_close
+
+
+class BrowserPool(_BrowserPoolBase):
+    """
+    A pool of sync Playwright browsers handing out isolated browser contexts, so
+    recipes of a course don't pay for a Chromium cold start each.
+
+    Sync Playwright objects are bound to the thread that created them, so a pool
+    must only be used from one thread.
+    """
+
+    def __init__(
+        self, config: BrowserPoolConfig | None = None, logger: Logger | None = None
+    ):
+        super().__init__(config, logger)
+        self._playwright = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @contextmanager
+    def new_context(self, headless: bool = True, **context_options):
+        """
+        Yield a fresh `BrowserContext`, closed when leaving the block.
+        """
+        self._close_browsers(self._to_close())
+
+        browser = self._pick(headless)
+
+        if browser is None:
+            browser = self._launch(headless)
+
+        self._acquire(browser)
+
+        try:
+            context: BrowserContext = browser.browser.new_context(**context_options)
+        except Exception:
+            self._release(browser)
+            raise
+
+        try:
+            yield context
+        finally:
+            context.close()
+            self._release(browser)
+            self._close_browsers(self._to_close())
+
+    def close(self) -> None:
+        self._close_browsers(self.browsers)
+        self.browsers = []
+
+        if self._playwright is not None:
+            self._playwright.stop()
+            self._playwright = None
+
+    def _launch(self, headless: bool) -> PooledBrowser:
+        if self._playwright is None:
+            from playwright.sync_api import sync_playwright
+
+            self._playwright = sync_playwright().start()
+
+        self.logger.info(f"Launching pooled browser (headless={headless})")
+
+        with profile("browser launch", "browser"):
+            browser = PooledBrowser(
+                self._playwright.chromium.launch(headless=headless), headless
+            )
+        self.browsers.append(browser)
+
+        return browser
+
+    def _close_browsers(self, browsers: list[PooledBrowser]) -> None:
+        for browser in list(browsers):
+            self.logger.info(f"Closing pooled browser after {browser.uses} uses")
+            browser.browser.close()
+
+
+class AsyncBrowserPool(_BrowserPoolBase):
+    """
+    Same as `BrowserPool` for `playwright.async_api`. Concurrent recipes share
+    the pool's browsers, each in its own context.
+    """
+
+    def __init__(
+        self, config: BrowserPoolConfig | None = None, logger: Logger | None = None
+    ):
+        import asyncio
+
+        super().__init__(config, logger)
+        self._playwright = None
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    @asynccontextmanager
+    async def new_context(self, headless: bool = True, **context_options):
+        """
+        Yield a fresh async `BrowserContext`, closed when leaving the block.
+        """
+        async with self._lock:
+            await self._close_browsers(self._to_close())
+
+            browser = self._pick(headless)
+
+            if browser is None:
+                browser = await self._launch(headless)
+
+            self._acquire(browser)
+
+        try:
+            context: AsyncBrowserContext = await browser.browser.new_context(
+                **context_options
+            )
+        except Exception:
+            self._release(browser)
+            raise
+
+        try:
+            yield context
+        finally:
+            await context.close()
+            self._release(browser)
+
+            async with self._lock:
+                await self._close_browsers(self._to_close())
+
+    async def close(self) -> None:
+        await self._close_browsers(self.browsers)
+        self.browsers = []
+
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch(self, headless: bool) -> PooledBrowser:
+        if self._playwright is None:
+            from playwright.async_api import async_playwright
+
+            self._playwright = await async_playwright().start()
+
+        self.logger.info(f"Launching pooled browser (headless={headless})")
+
+        with profile("browser launch", "browser"):
+            browser = PooledBrowser(
+                await self._playwright.chromium.launch(headless=headless), headless
+            )
+        self.browsers.append(browser)
+
+        return browser
+
+    async def _close_browsers(self, browsers: list[PooledBrowser]) -> None:
+        for browser in list(browsers):
+            self.logger.info(f"Closing pooled browser after {browser.uses} uses")
+            await browser.browser.close()
@@ -0,0 +1,146 @@
+import base64
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from models.output_store import OutputStore
+from models.store import get_store_dir
+
+CHECKPOINTS_DIRNAME = "homecook_checkpoints"
+
+# Marks the bytes outputs encoded in base64 in the checkpoint files
+BYTES_KEY = "__bytes__"
+
+
+class Checkpoint(BaseModel):
+    """
+    Progress of a recipe run: the steps already completed and their outputs.
+
+    It is saved after every step (when `Config.checkpoint` is on) and deleted
+    once the recipe completes, so a failed run can be resumed from the failed
+    step with `single-dish --resume <run_id>`.
+    """
+
+    run_id: str
+    recipe: dict[str, any]
+    completed: list[int] = []
+    params: dict[str, any] = {}
+    failed_step: int | None = None
+    error: str | None = None
+    # Browser state of Playwright recipes, saved when a step fails
+    storage_state_path: str | None = None
+    url: str | None = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # Store of `params` for the current process, see `Recipe._output_store`
+    _output_store: OutputStore | None = PrivateAttr(default=None)
+
+    @classmethod
+    def new(cls, recipe_name: str, recipe: dict[str, any]) -> "Checkpoint":
+        run_id = f"{recipe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+
+        return cls(run_id=run_id, recipe=recipe)
+
+    @classmethod
+    def load(cls, run_id: str) -> "Checkpoint":
+        path = checkpoint_path(run_id)
+
+        if not path.exists():
+            raise FileNotFoundError(f"No checkpoint found for run '{run_id}'.")
+
+        with open(path, "r") as f:
+            return cls(**json.load(f, object_hook=_decode_bytes))
+
+    @property
+    def path(self) -> Path:
+        return checkpoint_path(self.run_id)
+
+    @property
+    def blob_dir(self) -> Path:
+        """
+        Where the `OutputStore` spills the large outputs of the run.
+        """
+        return checkpoints_dir() / f"{self.run_id}_blobs"
+
+    @property
+    def default_storage_state_path(self) -> Path:
+        return checkpoints_dir() / f"{self.run_id}_storage_state.json"
+
+    def save(self) -> set[str]:
+        """
+        Write the checkpoint. The outputs that can't be written as JSON are left
+        out, and their steps marked as not completed so a resumed run runs them
+        again instead of reading a wrong value.
+
+        :return: The names of the steps whose outputs were left out.
+        """
+        data = self.model_dump()
+        unsaved = {
+            name for name, value in self.params.items() if not _serializable(value)
+        }
+
+        if unsaved:
+            data["params"] = {
+                name: value
+                for name, value in data["params"].items()
+                if name not in unsaved
+            }
+            data["completed"] = [
+                index
+                for index in self.completed
+                if self.recipe["steps"][index]["name"] not in unsaved
+            ]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write then rename so a crash mid-write never leaves a broken checkpoint
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, default=_encode_bytes)
+
+        os.replace(tmp_path, self.path)
+
+        return unsaved
+
+    def delete(self) -> None:
+        self.path.unlink(missing_ok=True)
+        shutil.rmtree(self.blob_dir, ignore_errors=True)
+
+        if self.storage_state_path:
+            Path(self.storage_state_path).unlink(missing_ok=True)
+
+
+def _encode_bytes(value: any) -> any:
+    if isinstance(value, bytes):
+        return {BYTES_KEY: base64.b64encode(value).decode("ascii")}
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _serializable(value: any) -> bool:
+    try:
+        json.dumps(value, default=_encode_bytes)
+    except (TypeError, ValueError):
+        return False
+
+    return True
+
+
+def _decode_bytes(value: dict[str, any]) -> any:
+    if len(value) == 1 and BYTES_KEY in value:
+        return base64.b64decode(value[BYTES_KEY])
+
+    return value
+
+
+def checkpoints_dir() -> Path:
+    return get_store_dir() / CHECKPOINTS_DIRNAME
+
+
+def checkpoint_path(run_id: str) -> Path:
+    return checkpoints_dir() / f"{run_id}.json"
@@ -1,10 +1,27 @@
+from enum import Enum
 from pydantic import BaseModel
+from models.step.custom_step import CustomConfig
 from models.step.playwright_step import PlayWrightConfig
 from models.step.fs_step import FsConfig
+from models.output_store import OutputStoreConfig
+from models.step_cache import StepCacheConfig
+
+
+class PacingMode(Enum):
+    FIXED = "FIXED"  # sleep slow_mode after every step
+    ADAPTIVE = "ADAPTIVE"  # wait for the page to settle, at most slow_mode
 
 
 class Config(BaseModel):
     slow_mode: int = 0  # in milliseconds
+    pacing: PacingMode = PacingMode.FIXED
     cwd: str = "."
+    parallel_steps: int = 0  # worker count, 0 runs the steps in order
+    checkpoint: bool = True  # save the progress of failed runs to resume them
+    # Also save the progress after every step, to resume after a crash
+    checkpoint_every_step: bool = False
     playwright_config: PlayWrightConfig | None = None
     fs_config: FsConfig | None = None
+    custom_config: CustomConfig = CustomConfig()
+    step_cache: StepCacheConfig = StepCacheConfig()
+    output_store: OutputStoreConfig = OutputStoreConfig()
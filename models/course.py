@@ -1,84 +1,455 @@
+from collections.abc import Iterator
+from enum import Enum
 import json
 import logging
 from pathlib import Path
-from pydantic import BaseModel
+import sys
+import time
+from pydantic import BaseModel, ConfigDict
 from windows_toasts import Toast, WindowsToaster
 
+from models.browser_pool import AsyncBrowserPool, BrowserPool, BrowserPoolConfig
+from models.profiler import ProfileSpan, enable_profiler, profile
 from models.recipe import Recipe
 from string import Template
 
 from models.store import load_recipe_from_store
 
 
+class RecipeTemplate(Template):
+    """
+    `string.Template` for the course variables that leaves the step output
+    references like `${extract_title.text}` or `${step.records[0]|none}` to
+    the steps, instead of rejecting them as invalid placeholders.
+    """
+
+    pattern = r"""
+    \$(?:
+        (?P<escaped>\$) |
+        (?P<named>(?a:[_a-z][_a-z0-9]*)) |
+        {(?P<braced>(?a:[_a-z][_a-z0-9]*))} |
+        (?P<invalid>(?!{[^}]*[.\[|][^}]*}))
+    )
+    """
+
+
+class ErrorPolicy(Enum):
+    FAIL_FAST = "fail-fast"
+    CONTINUE = "continue"
+
+
+class RecipeStatus(Enum):
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
+class RecipeResult(BaseModel):
+    index: int
+    name: str
+    status: RecipeStatus
+    duration: float = 0  # in seconds
+    error: str | None = None
+
+
 class Course(BaseModel):
     title: str
     description: str
     recipes: list[Recipe] = []
+    # Menu entries of a lazy course, loaded into recipes one at a time
+    menu_recipes: list[dict[str, any]] = []
+    browser_pool: BrowserPoolConfig = BrowserPoolConfig()
+    logger: logging.Logger | None = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
 
     @classmethod
     def from_menu_file(
         cls,
         menu_file: Path,
         logger: logging.Logger,
+        lazy: bool = False,
+        validate: bool = False,
     ) -> "Course":
+        """
+        :param lazy: Load every recipe only when it is about to be cooked (see
+            `iter_recipes`), instead of all of them upfront.
+        :param validate: Load and compile every recipe first without keeping
+            them, so an invalid recipe fails the course before anything cooks.
+        """
         with open(menu_file, "r") as f:
             data = json.load(f)
 
         recipes_used = data.get("recipes", [])
-        recipes: list[Recipe] = []
 
         if not recipes_used:
             raise ValueError("Course must contain at least one recipe.")
 
-        for recipe_data in recipes_used:
-            recipe_variables = recipe_data.get("variable", {})
+        course = cls(
+            title=data.get("title", "Untitled Course"),
+            description=data.get("description", ""),
+            menu_recipes=recipes_used,
+            browser_pool=BrowserPoolConfig(**data.get("browser_pool", {})),
+            logger=logger,
+        )
+
+        if validate:
+            course.validate_recipes()
 
-            recipe_template = Template(load_recipe_text(recipe_data))
+        if not lazy:
+            course.recipes = [load_recipe(entry, logger) for entry in recipes_used]
+            course.menu_recipes = []
 
-            rendered_recipe = recipe_template.substitute(recipe_variables)
+        return course
 
-            recipe = json.loads(rendered_recipe)
+    @property
+    def recipe_count(self) -> int:
+        return len(self.menu_recipes) or len(self.recipes)
 
-            recipes.append(Recipe.from_dict(recipe, logger=logger))
+    def iter_recipes(self) -> Iterator[Recipe]:
+        """
+        Yield the recipes of the course. A lazy course loads them one at a
+        time, the next one on a background thread while the current one is
+        cooked, so only a couple of recipes are in memory whatever the menu
+        size.
+        """
+        if not self.menu_recipes:
+            yield from self.recipes
+            return
 
-        return cls(
-            title=data.get("title", "Untitled Course"),
-            description=data.get("description", ""),
-            recipes=recipes,
-        )
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="homecook-menu"
+        ) as executor:
+            next_recipe = executor.submit(
+                load_recipe, self.menu_recipes[0], self.logger
+            )
+
+            for index in range(len(self.menu_recipes)):
+                recipe = next_recipe.result()
+
+                if index + 1 < len(self.menu_recipes):
+                    next_recipe = executor.submit(
+                        load_recipe, self.menu_recipes[index + 1], self.logger
+                    )
+
+                yield recipe
+
+    def validate_recipes(self) -> None:
+        """
+        Load and compile every recipe of the menu without keeping them, and
+        raise a ValueError listing all the invalid ones.
+        """
+        errors: list[str] = []
+
+        for index, entry in enumerate(self.menu_recipes):
+            try:
+                load_recipe(entry, self.logger).validate()
+            except (OSError, KeyError, ValueError) as e:
+                errors.append(f"#{index} ({menu_entry_name(entry)}): {e}")
+
+        if errors:
+            raise ValueError("Invalid recipes in the menu:\n" + "\n".join(errors))
+
+    def _recipe_name(self, index: int) -> str:
+        if self.menu_recipes:
+            return menu_entry_name(self.menu_recipes[index])
+
+        return self.recipes[index].metadata.name
 
     def execute_all_recipes(self, toaster: WindowsToaster) -> None:
-        for index, recipe in enumerate(self.recipes):
-            logging.info(f"Starting recipe: {recipe.metadata.name}")
+        with BrowserPool(self.browser_pool, logger=self.logger) as pool:
+            for index, recipe in enumerate(self.iter_recipes()):
+                self._execute_recipe(index, recipe, toaster=toaster, pool=pool)
+
+    def _execute_recipe(
+        self,
+        index: int,
+        recipe: Recipe,
+        toaster: WindowsToaster,
+        pool: BrowserPool | None = None,
+    ) -> None:
+        logging.info(f"Starting recipe: {recipe.metadata.name}")
+
+        toaster.show_toast(
+            Toast(["Begin cooking", f"#{index}: {recipe.metadata.name}"])
+        )
+
+        try:
+            recipe.cook(pool=pool)
+        except Exception as e:
+            toaster.show_toast(
+                Toast(
+                    [
+                        "Cooking failed",
+                        f"Recipe #{index} ({recipe.metadata.name}) failed to cook",
+                    ]
+                )
+            )
+            raise e
+
+        toaster.show_toast(
+            Toast(["Cooking finished", f"Finish {index + 1}/{self.recipe_count}"])
+        )
+
+        logging.info(f"Finished recipe: {recipe.metadata.name}")
+
+    def execute_all_recipes_parallel(
+        self,
+        toaster: WindowsToaster,
+        max_workers: int,
+        on_error: ErrorPolicy = ErrorPolicy.FAIL_FAST,
+        log_dir: Path | None = None,
+        log_level: int = logging.INFO,
+    ) -> list[RecipeResult]:
+        """
+        Cook the recipes on a pool of `max_workers` processes, each process
+        sharing its own browser pool between the recipes it cooks.
+
+        Every recipe logs to its own logger (see `recipe_logger`). With
+        `ErrorPolicy.FAIL_FAST` the first failure cancels the recipes that
+        haven't started yet.
+        """
+        from concurrent.futures import (
+            FIRST_COMPLETED,
+            BrokenExecutor,
+            CancelledError,
+            Future,
+            ProcessPoolExecutor,
+            wait,
+        )
+        from contextlib import closing
+        from pickle import PickleError
+
+        from models import profiler
+
+        results: list[RecipeResult] = []
+        running: dict[Future, tuple[int, str]] = {}
+        cancelled = False
+
+        # Recipes are handed to the workers a few at a time, so a lazy course
+        # never loads much more than what is cooking
+        max_pending = max_workers * 2
+
+        with (
+            closing(self.iter_recipes()) as recipes,
+            ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.browser_pool,
+                    self.logger.name if self.logger else None,
+                    profiler.PROFILER is not None,
+                ),
+            ) as executor,
+        ):
+            submitted = 0
+
+            while True:
+                while (
+                    not cancelled
+                    and submitted < self.recipe_count
+                    and len(running) < max_pending
+                ):
+                    recipe = next(recipes)
+                    future = executor.submit(
+                        _cook_in_worker, submitted, recipe, log_dir, log_level
+                    )
+                    running[future] = (submitted, recipe.metadata.name)
+                    submitted += 1
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index, name = running.pop(future)
+
+                    try:
+                        result, spans = future.result()
+                    except CancelledError:
+                        result = RecipeResult(
+                            index=index, name=name, status=RecipeStatus.CANCELLED
+                        )
+                    except (BrokenExecutor, PickleError, OSError) as e:
+                        # The worker itself died or its result couldn't be sent back
+                        result = RecipeResult(
+                            index=index,
+                            name=name,
+                            status=RecipeStatus.FAILED,
+                            error=str(e),
+                        )
+                    else:
+                        if profiler.PROFILER:
+                            profiler.PROFILER.merge(spans)
+
+                    self._show_result_toast(toaster, result)
+                    results.append(result)
+
+                    if (
+                        result.status == RecipeStatus.FAILED
+                        and on_error == ErrorPolicy.FAIL_FAST
+                    ):
+                        cancelled = True
+
+                        for pending in running:
+                            pending.cancel()
+
+        for index in range(submitted, self.recipe_count):
+            results.append(
+                RecipeResult(
+                    index=index,
+                    name=self._recipe_name(index),
+                    status=RecipeStatus.CANCELLED,
+                )
+            )
+
+        return sorted(results, key=lambda result: result.index)
+
+    async def execute_all_recipes_async(
+        self,
+        toaster: WindowsToaster,
+        max_concurrency: int | None = None,
+        on_error: ErrorPolicy = ErrorPolicy.FAIL_FAST,
+        log_dir: Path | None = None,
+        log_level: int = logging.INFO,
+    ) -> list[RecipeResult]:
+        """
+        Cook the recipes concurrently on the running event loop, at most
+        `max_concurrency` at a time, each in its own context of a shared
+        async browser pool.
+
+        With `ErrorPolicy.FAIL_FAST` the first failure cancels the recipes
+        still cooking.
+        """
+        import asyncio
+
+        # Also bounds the recipes loaded ahead of a lazy course
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        tasks: list[asyncio.Task] = []
+        names: list[str] = []
+        cancelled = False
+
+        async def cook(index: int, recipe: Recipe) -> RecipeResult:
+            nonlocal cancelled
+
+            recipe.logger = recipe_logger(index, recipe, log_dir, log_level)
 
             toaster.show_toast(
                 Toast(["Begin cooking", f"#{index}: {recipe.metadata.name}"])
             )
 
+            start = time.perf_counter()
             try:
-                recipe.cook()
+                await recipe.cook_async(pool=pool)
             except Exception as e:
+                recipe.logger.exception(f"Recipe #{index} failed")
+
+                result = RecipeResult(
+                    index=index,
+                    name=recipe.metadata.name,
+                    status=RecipeStatus.FAILED,
+                    duration=time.perf_counter() - start,
+                    error=str(e),
+                )
+            else:
+                result = RecipeResult(
+                    index=index,
+                    name=recipe.metadata.name,
+                    status=RecipeStatus.SUCCEEDED,
+                    duration=time.perf_counter() - start,
+                )
+
+            self._show_result_toast(toaster, result)
+
+            if (
+                result.status == RecipeStatus.FAILED
+                and on_error == ErrorPolicy.FAIL_FAST
+            ):
+                cancelled = True
+
+                for task in tasks:
+                    if task is not asyncio.current_task():
+                        task.cancel()
+
+            return result
+
+        async with AsyncBrowserPool(self.browser_pool, logger=self.logger) as pool:
+            recipes = self.iter_recipes()
+
+            try:
+                for index in range(self.recipe_count):
+                    if semaphore:
+                        await semaphore.acquire()
+
+                    if cancelled:
+                        break
+
+                    # Loading reads and validates files, keep it off the loop
+                    recipe = await asyncio.to_thread(next, recipes)
+                    task = asyncio.create_task(cook(index, recipe))
+
+                    if semaphore:
+                        # Also released by the tasks cancelled before starting
+                        task.add_done_callback(lambda _: semaphore.release())
+
+                    tasks.append(task)
+                    names.append(recipe.metadata.name)
+            finally:
+                await asyncio.to_thread(recipes.close)
+
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+        results: list[RecipeResult] = []
+
+        for index, outcome in enumerate(outcomes):
+            if isinstance(outcome, RecipeResult):
+                results.append(outcome)
+            else:
+                results.append(
+                    RecipeResult(
+                        index=index, name=names[index], status=RecipeStatus.CANCELLED
+                    )
+                )
+
+        # Recipes never started after a failure
+        for index in range(len(outcomes), self.recipe_count):
+            results.append(
+                RecipeResult(
+                    index=index,
+                    name=self._recipe_name(index),
+                    status=RecipeStatus.CANCELLED,
+                )
+            )
+
+        return results
+
+    def _show_result_toast(self, toaster: WindowsToaster, result: RecipeResult) -> None:
+        match result.status:
+            case RecipeStatus.SUCCEEDED:
+                toaster.show_toast(
+                    Toast(
+                        ["Cooking finished", f"Finish #{result.index}: {result.name}"]
+                    )
+                )
+            case RecipeStatus.FAILED:
                 toaster.show_toast(
                     Toast(
                         [
                             "Cooking failed",
-                            f"Recipe #{index} ({recipe.metadata.name}) failed to cook",
+                            f"Recipe #{result.index} ({result.name}) failed to cook",
                         ]
                     )
                 )
-                raise e
-
-            toaster.show_toast(
-                Toast(["Cooking finished", f"Finish {index + 1}/{len(self.recipes)}"])
-            )
-
-            logging.info(f"Finished recipe: {recipe.metadata.name}")
 
     @staticmethod
     def to_sample_dict() -> dict[str, any]:
         return {
             "title": "Sample Course",
             "description": "A sample course containing multiple recipes.",
+            "browser_pool": BrowserPoolConfig.to_sample_dict(),
             "recipes": [
                 {
                     "key": "recipe1",
@@ -99,6 +470,26 @@ class Course(BaseModel):
         }
 
 
+def load_recipe(data: dict[str, any], logger: logging.Logger) -> Recipe:
+    """
+    Load the recipe of a menu entry, rendered with the entry's variables.
+    """
+    recipe_template = RecipeTemplate(load_recipe_text(data))
+
+    with profile("template render", "load"):
+        rendered_recipe = recipe_template.substitute(data.get("variable", {}))
+
+    return Recipe.from_dict(json.loads(rendered_recipe), logger=logger)
+
+
+def menu_entry_name(data: dict[str, any]) -> str:
+    """
+    Name of a menu entry's recipe without loading it: its store key or its
+    file name.
+    """
+    return data.get("key") or Path(data.get("path", "recipe")).stem
+
+
 def load_recipe_text(data: dict[str, any]) -> str:
     path = data.get("path")
     key = data.get("key")
@@ -116,3 +507,109 @@ def load_recipe_text(data: dict[str, any]) -> str:
 
     else:
         return load_recipe_from_store(key)
+
+
+def recipe_logger(
+    index: int, recipe: Recipe, log_dir: Path | None, level: int
+) -> logging.Logger:
+    """
+    A dedicated logger for a recipe cooked alongside others. It writes to its own
+    file in `log_dir`, or to stdout with a prefix, so the logs of concurrent
+    recipes can be told apart.
+    """
+    name = f"{index}_{recipe.metadata.name}"
+
+    logger = logging.getLogger(f"HomeCook_Recipe.{name}")
+    logger.setLevel(level)
+    logger.propagate = False
+
+    if not logger.handlers:
+        if log_dir:
+            Path(log_dir).mkdir(parents=True, exist_ok=True)
+            handler = logging.FileHandler(Path(log_dir) / f"{name}.log")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        else:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter(f"[#{name}] %(message)s"))
+
+        logger.addHandler(handler)
+
+    return logger
+
+
+def format_results_summary(results: list[RecipeResult]) -> str:
+    lines = [f"{'#':>3}  {'Recipe':<30}  {'Status':<10}  {'Time (s)':>8}  Error"]
+
+    for result in results:
+        lines.append(
+            f"{result.index:>3}  {result.name:<30}  {result.status.value:<10}  "
+            f"{result.duration:>8.2f}  {result.error or ''}".rstrip()
+        )
+
+    succeeded = sum(result.status == RecipeStatus.SUCCEEDED for result in results)
+    lines.append(f"{succeeded}/{len(results)} recipes succeeded")
+
+    return "\n".join(lines)
+
+
+# Browser pool of a worker process, created by the process pool initializer
+_WORKER_BROWSER_POOL: BrowserPool | None = None
+
+
+def _init_worker(
+    pool_config: BrowserPoolConfig, logger_name: str | None, profiling: bool = False
+) -> None:
+    from multiprocessing.util import Finalize
+
+    global _WORKER_BROWSER_POOL
+
+    if profiling:
+        # The spans are sent back with every result, see `_cook_in_worker`
+        enable_profiler()
+
+    # Loggers can't be pickled, the worker uses the course's logger by name
+    _WORKER_BROWSER_POOL = BrowserPool(
+        pool_config, logger=logging.getLogger(logger_name)
+    )
+
+    # Worker processes exit without running atexit hooks, but they do run the
+    # multiprocessing finalizers
+    Finalize(_WORKER_BROWSER_POOL, _WORKER_BROWSER_POOL.close, exitpriority=10)
+
+
+def _cook_in_worker(
+    index: int, recipe: Recipe, log_dir: Path | None, log_level: int
+) -> tuple[RecipeResult, list[ProfileSpan]]:
+    """
+    Cook a recipe in a worker process. Returns its result and the profile
+    spans the worker recorded since its last recipe, empty when profiling is
+    off.
+    """
+    from models import profiler
+
+    recipe.logger = recipe_logger(index, recipe, log_dir, log_level)
+
+    start = time.perf_counter()
+    try:
+        recipe.cook(pool=_WORKER_BROWSER_POOL)
+    except Exception as e:
+        recipe.logger.exception(f"Recipe #{index} failed")
+
+        result = RecipeResult(
+            index=index,
+            name=recipe.metadata.name,
+            status=RecipeStatus.FAILED,
+            duration=time.perf_counter() - start,
+            error=str(e),
+        )
+    else:
+        result = RecipeResult(
+            index=index,
+            name=recipe.metadata.name,
+            status=RecipeStatus.SUCCEEDED,
+            duration=time.perf_counter() - start,
+        )
+
+    spans = profiler.PROFILER.drain() if profiler.PROFILER else []
+
+    return result, spans
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from pydantic import BaseModel
+
+from models.browser_pool import BrowserPool, BrowserPoolConfig
+from models.daemon_client import TOKEN_HEADER, RunStatus, daemon_state_path
+
+# Finished runs kept for `/runs/<run_id>` before the oldest are dropped
+MAX_FINISHED_RUNS = 1000
+
+
+class DaemonConfig(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 0  # 0 picks a free port, published in the daemon state file
+    workers: int = 2  # recipes cooked at the same time
+    max_queue: int = 100  # queued recipes before new submissions are refused
+    browser_pool: BrowserPoolConfig = BrowserPoolConfig()
+
+
+class DaemonRun(BaseModel):
+    run_id: str
+    name: str
+    status: RunStatus = RunStatus.QUEUED
+    submitted_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    error: str | None = None
+    log: list[str] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (RunStatus.SUCCEEDED, RunStatus.FAILED)
+
+
+class _RunLogHandler(logging.Handler):
+    def __init__(self, run: DaemonRun):
+        super().__init__()
+        self.run = run
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.run.log.append(self.format(record))
+
+
+class Daemon:
+    """
+    Long running process cooking the recipes submitted over loopback HTTP, so
+    each `single-dish` invocation skips the imports and the Chromium launch.
+
+    Every worker thread owns a `BrowserPool` (sync Playwright objects are bound
+    to their thread) and keeps its browsers warm between recipes. Requests
+    must carry the token published in the daemon state file, which only the
+    user running the daemon can read.
+    """
+
+    def __init__(self, config: DaemonConfig, logger: logging.Logger):
+        self.config = config
+        self.logger = logger
+        self.token = secrets.token_urlsafe(32)
+        self.runs: dict[str, DaemonRun] = {}
+        self._queue: queue.Queue[tuple[DaemonRun, dict[str, any]] | None] = queue.Queue(
+            maxsize=config.max_queue
+        )
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._workers: list[threading.Thread] = []
+        self._server = None
+
+    def serve_forever(self) -> None:
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer(
+            (self.config.host, self.config.port), _handler_class(self)
+        )
+        host, port = self._server.server_address[:2]
+
+        for index in range(self.config.workers):
+            worker = threading.Thread(
+                target=self._work, name=f"homecook-worker-{index}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+        write_daemon_state({"host": host, "port": port, "token": self.token})
+        self.logger.info(
+            f"HomeCook daemon listening on http://{host}:{port} "
+            f"with {self.config.workers} workers"
+        )
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        daemon_state_path().unlink(missing_ok=True)
+
+        # Drop the recipes that haven't started, the running ones finish
+        while True:
+            try:
+                run, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            run.status = RunStatus.FAILED
+            run.error = "The daemon shut down before the run started."
+
+        for _ in self._workers:
+            self._queue.put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+        self._server.server_close()
+
+    def submit(self, recipe_data: dict[str, any]) -> DaemonRun:
+        """
+        Queue a recipe, raises `queue.Full` when `max_queue` recipes are waiting.
+        """
+        name = recipe_data.get("metadata", {}).get("name", "recipe")
+        run = DaemonRun(
+            run_id=f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
+            name=name,
+            submitted_at=datetime.now(),
+        )
+
+        self._queue.put_nowait((run, recipe_data))
+
+        with self._lock:
+            self.runs[run.run_id] = run
+            self._drop_finished_runs()
+
+        return run
+
+    def status(self) -> dict[str, any]:
+        with self._lock:
+            counts = {status.value: 0 for status in RunStatus}
+
+            for run in self.runs.values():
+                counts[run.status.value] += 1
+
+            return {
+                "pid": os.getpid(),
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.config.max_queue,
+                "workers": self.config.workers,
+                "busy_workers": self._busy,
+                "runs": counts,
+            }
+
+    def _work(self) -> None:
+        # A worker cooks one run at a time, so its logger is reused by all its
+        # runs, each capturing the logs through its own handler
+        logger = logging.getLogger(f"HomeCook_Daemon.{threading.current_thread().name}")
+
+        with BrowserPool(self.config.browser_pool, logger=self.logger) as pool:
+            while True:
+                item = self._queue.get()
+
+                if item is None:
+                    return
+
+                run, recipe_data = item
+
+                with self._lock:
+                    self._busy += 1
+
+                try:
+                    self._cook(run, recipe_data, pool, logger)
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+
+    def _cook(
+        self,
+        run: DaemonRun,
+        recipe_data: dict[str, any],
+        pool: BrowserPool,
+        logger: logging.Logger,
+    ) -> None:
+        from models.recipe import Recipe
+
+        logger.setLevel(self.logger.getEffectiveLevel())
+        handler = _RunLogHandler(run)
+        logger.addHandler(handler)
+
+        run.status = RunStatus.RUNNING
+        run.started_at = datetime.now()
+        self.logger.info(f"Cooking run {run.run_id}")
+
+        try:
+            recipe = Recipe.from_dict(recipe_data, logger=logger)
+            recipe.cook(pool=pool)
+        except Exception as e:
+            logger.exception(f"Run {run.run_id} failed")
+            run.error = str(e)
+            run.status = RunStatus.FAILED
+        else:
+            run.status = RunStatus.SUCCEEDED
+        finally:
+            run.finished_at = datetime.now()
+            logger.removeHandler(handler)
+            self.logger.info(f"Run {run.run_id} {run.status.value.lower()}")
+
+    def _drop_finished_runs(self) -> None:
+        finished = [run_id for run_id, run in self.runs.items() if run.finished]
+
+        for run_id in finished[: max(0, len(finished) - MAX_FINISHED_RUNS)]:
+            del self.runs[run_id]
+
+
+def _handler_class(daemon: Daemon):
+    from http.server import BaseHTTPRequestHandler
+
+    class DaemonRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self._authorized():
+                return
+
+            path, _, query = self.path.partition("?")
+
+            if path == "/status":
+                self._reply(200, daemon.status())
+            elif path.startswith("/runs/"):
+                run = daemon.runs.get(path.removeprefix("/runs/"))
+
+                if run is None:
+                    self._reply(404, {"error": "Unknown run."})
+                    return
+
+                # `since` skips the log lines the client already has
+                since = int(parse_qs(query).get("since", ["0"])[0])
+                body = run.model_dump(mode="json", exclude={"log"})
+                body["log"] = run.log[since:]
+
+                self._reply(200, body)
+            else:
+                self._reply(404, {"error": "Not found."})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+
+            if self.path != "/runs":
+                self._reply(404, {"error": "Not found."})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+
+            try:
+                recipe_data = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError as e:
+                self._reply(400, {"error": f"Invalid recipe: {e}"})
+                return
+
+            try:
+                run = daemon.submit(recipe_data)
+            except queue.Full:
+                self._reply(503, {"error": "The daemon queue is full."})
+                return
+
+            self._reply(202, run.model_dump(mode="json", exclude={"log"}))
+
+        def log_message(self, format, *args):
+            daemon.logger.debug(format % args)
+
+        def _authorized(self) -> bool:
+            if secrets.compare_digest(self.headers.get(TOKEN_HEADER, ""), daemon.token):
+                return True
+
+            self._reply(403, {"error": "Invalid token."})
+            return False
+
+        def _reply(self, status: int, body: dict[str, any]) -> None:
+            content = json.dumps(body).encode()
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return DaemonRequestHandler
+
+
+def write_daemon_state(state: dict[str, any]) -> None:
+    path = daemon_state_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Readable by the owner only, the token authenticates the clients
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
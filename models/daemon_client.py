@@ -0,0 +1,167 @@
+# Client side of the HomeCook daemon, kept apart from `models.daemon` so that
+# submitting a recipe doesn't import Playwright, pydantic or the recipe models
+import json
+from enum import Enum
+from pathlib import Path
+
+from models.store import get_store_dir
+
+DAEMON_STATE_FILENAME = "homecook_daemon.json"
+TOKEN_HEADER = "X-HomeCook-Token"
+
+# Config fields holding paths, relative to the working directory of the process
+# cooking the recipe
+CONFIG_PATH_FIELDS = [
+    "cwd",
+    "fs_config.cwd",
+    "playwright_config.screen_shot_path",
+    "playwright_config.storage_state_path",
+    "playwright_config.replay.har_path",
+    "playwright_config.replay.cache_dir",
+    "custom_config.cache_dir",
+    "step_cache.cache_dir",
+]
+
+# Step parameters holding paths resolved against the working directory, by
+# action. FS steps resolve theirs against `fs_config.cwd`.
+STEP_PATH_PARAMETERS = {
+    "UPLOAD_FILE": ["file_path"],
+    "DOWNLOAD_FILE": ["download_path", "download_dir"],
+}
+
+
+class RunStatus(Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+class DaemonClient:
+    """
+    Client of a running daemon, found through the daemon state file.
+    """
+
+    def __init__(self, host: str, port: int, token: str):
+        self.base_url = f"http://{host}:{port}"
+        self.token = token
+
+    @classmethod
+    def discover(cls, timeout: float = 0.5) -> "DaemonClient | None":
+        """
+        Return a client of the running daemon, or None when no daemon answers.
+        """
+        try:
+            with open(daemon_state_path(), "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        client = cls(state["host"], state["port"], state["token"])
+
+        try:
+            client.status(timeout=timeout)
+        except (OSError, RuntimeError):
+            # Stale state file of a daemon that didn't shut down cleanly
+            return None
+
+        return client
+
+    def status(self, timeout: float | None = None) -> dict[str, any]:
+        return self._request("GET", "/status", timeout=timeout)
+
+    def submit(self, recipe_data: dict[str, any]) -> dict[str, any]:
+        return self._request("POST", "/runs", body=recipe_data)
+
+    def run(self, run_id: str, since: int = 0) -> dict[str, any]:
+        return self._request("GET", f"/runs/{run_id}?since={since}")
+
+    def wait(self, run_id: str, on_log=None, poll_interval: float = 0.2) -> dict:
+        """
+        Poll a run until it finishes, passing its new log lines to `on_log`.
+        """
+        import time
+
+        since = 0
+
+        while True:
+            run = self.run(run_id, since=since)
+            since += len(run["log"])
+
+            if on_log:
+                for line in run["log"]:
+                    on_log(line)
+
+            if run["status"] in (RunStatus.SUCCEEDED.value, RunStatus.FAILED.value):
+                return run
+
+            time.sleep(poll_interval)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: dict[str, any] | None = None,
+        timeout: float | None = None,
+    ) -> dict[str, any]:
+        import urllib.error
+        import urllib.request
+
+        request = urllib.request.Request(
+            self.base_url + path,
+            method=method,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={TOKEN_HEADER: self.token, "Content-Type": "application/json"},
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(
+                json.load(e).get("error", f"Daemon returned HTTP {e.code}")
+            ) from None
+
+
+def daemon_state_path() -> Path:
+    return get_store_dir() / DAEMON_STATE_FILENAME
+
+
+def absolute_recipe_paths(recipe_data: dict[str, any], base: Path) -> dict[str, any]:
+    """
+    Make the relative paths of a recipe's config and of its Playwright step
+    parameters absolute against `base`, so the recipe can be cooked by a
+    process with another working directory, e.g. the daemon. Parameters
+    resolved from the outputs of other steps are left as is.
+    """
+    config = recipe_data.get("config") or {}
+
+    for field in CONFIG_PATH_FIELDS:
+        *keys, last_key = field.split(".")
+        section = config
+
+        for key in keys:
+            section = section.get(key) if isinstance(section, dict) else None
+
+        if isinstance(section, dict) and section.get(last_key) is not None:
+            section[last_key] = str(Path(base) / section[last_key])
+
+    for step in recipe_data.get("steps", []):
+        if step.get("step_type") != "PLAYWRIGHT":
+            continue
+
+        parameters = step.get("parameters") or {}
+        referenced = set(step.get("parameter_paths") or [])
+
+        for name in STEP_PATH_PARAMETERS.get(step.get("action"), []):
+            value = parameters.get(name)
+
+            if (
+                isinstance(value, str)
+                and value
+                and "${" not in value
+                and name not in referenced
+            ):
+                parameters[name] = str(Path(base) / value)
+
+    return recipe_data
@@ -0,0 +1,190 @@
+import hashlib
+import mmap
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydantic import BaseModel
+
+# Marks the BlobRef dicts in the step outputs
+BLOB_REF_KEY = "__blob_ref__"
+
+
+class OutputStoreConfig(BaseModel):
+    inline_limit: int = 64 * 1024  # in bytes, larger texts and bytes are spilled
+    free_unreferenced: bool = True  # drop outputs no later step reads
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {"inline_limit": 64 * 1024, "free_unreferenced": True}
+
+
+class BlobRef(BaseModel):
+    """
+    Reference to a step output value spilled to disk by the `OutputStore`. Like
+    `FileHandle`, it is kept in the outputs as a plain dict (see `to_output`)
+    so it survives checkpoints.
+    """
+
+    path: str
+    size: int
+    binary: bool = False
+
+    def to_output(self) -> dict[str, any]:
+        return {BLOB_REF_KEY: True, **self.model_dump()}
+
+    @classmethod
+    def from_output(cls, value: any) -> "BlobRef | None":
+        if not (isinstance(value, dict) and value.get(BLOB_REF_KEY)):
+            return None
+
+        return cls(**{key: item for key, item in value.items() if key != BLOB_REF_KEY})
+
+    @contextmanager
+    def open_mmap(self) -> Iterator[mmap.mmap]:
+        """
+        Map the blob in memory, read only, without loading it. Blobs are never
+        empty, only values larger than the inline limit are spilled.
+        """
+        with (
+            open(self.path, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+        ):
+            yield mapped
+
+    def read(self) -> str | bytes:
+        with self.open_mmap() as mapped:
+            content = mapped[:]
+
+        return content if self.binary else content.decode("utf-8")
+
+
+class OutputStore:
+    """
+    The outputs of the steps of a run, as kept in `Checkpoint.params`.
+
+    Texts and bytes larger than `inline_limit` are written to a blob file of
+    the run and replaced by a `BlobRef`, read back only when a later step
+    resolves a parameter pointing at them (see `load_blobs`). Once every step
+    reading an output has completed, the output and its blobs are freed.
+    """
+
+    def __init__(
+        self,
+        config: OutputStoreConfig,
+        outputs: dict[str, any],
+        blob_dir: Path,
+        readers: dict[str, set[int]],
+    ):
+        """
+        :param outputs: The outputs dict, updated in place.
+        :param readers: For every step name, the indexes of the steps reading
+            its output that haven't completed yet (see
+            `models.scheduler.output_readers`).
+        """
+        self.config = config
+        self.outputs = outputs
+        self.blob_dir = Path(blob_dir)
+        self.readers = readers
+
+    def put(self, step_index: int, step_name: str, result: any) -> None:
+        """
+        Record the output of a completed step, then free the outputs it was the
+        last step to read.
+        """
+        if result and (
+            not self.config.free_unreferenced or self.readers.get(step_name)
+        ):
+            self.outputs[step_name] = self._spill(result, step_name)
+
+        if not self.config.free_unreferenced:
+            return
+
+        for name, indexes in self.readers.items():
+            if step_index in indexes:
+                indexes.discard(step_index)
+
+                if not indexes:
+                    self.free(name)
+
+    def free(self, step_name: str) -> None:
+        for ref in _blob_refs(self.outputs.pop(step_name, None)):
+            Path(ref.path).unlink(missing_ok=True)
+
+    def _spill(self, value: any, name: str) -> any:
+        if isinstance(value, dict):
+            if value.get(BLOB_REF_KEY):
+                return value
+
+            return {
+                key: self._spill(item, f"{name}.{key}") for key, item in value.items()
+            }
+
+        if isinstance(value, list):
+            return [
+                self._spill(item, f"{name}.{index}") for index, item in enumerate(value)
+            ]
+
+        if isinstance(value, (str, bytes)) and len(value) > self.config.inline_limit:
+            return self._write_blob(value, name).to_output()
+
+        return value
+
+    def _write_blob(self, value: str | bytes, name: str) -> BlobRef:
+        content = value if isinstance(value, bytes) else value.encode("utf-8")
+        path = self.blob_dir / f"{hashlib.sha256(name.encode()).hexdigest()}.blob"
+
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+
+        os.replace(tmp_path, path)
+
+        return BlobRef(
+            path=str(path), size=len(content), binary=isinstance(value, bytes)
+        )
+
+
+def load_blobs(value: any) -> any:
+    """
+    Return the value with its BlobRefs replaced by their contents. The dicts
+    and lists without BlobRefs are returned as is.
+    """
+    ref = BlobRef.from_output(value)
+
+    if ref is not None:
+        return ref.read()
+
+    if isinstance(value, dict):
+        loaded = {key: load_blobs(item) for key, item in value.items()}
+
+        if all(loaded[key] is item for key, item in value.items()):
+            return value
+
+        return loaded
+
+    if isinstance(value, list):
+        loaded = [load_blobs(item) for item in value]
+
+        if all(new is old for new, old in zip(loaded, value)):
+            return value
+
+        return loaded
+
+    return value
+
+
+def _blob_refs(value: any) -> Iterator[BlobRef]:
+    ref = BlobRef.from_output(value)
+
+    if ref is not None:
+        yield ref
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _blob_refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _blob_refs(item)
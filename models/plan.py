@@ -0,0 +1,118 @@
+import hashlib
+import json
+from collections import OrderedDict
+from collections.abc import Callable
+from threading import Lock
+
+from pydantic import BaseModel, ConfigDict
+
+from models.step.custom_step import CustomStep
+from models.step.fs_step import FsStep
+from models.step.playwright_step import PlaywrightStep
+from models.step.step import Step, StepType
+
+STEP_CLASSES: dict[StepType, type[Step]] = {
+    StepType.PLAYWRIGHT: PlaywrightStep,
+    StepType.FS: FsStep,
+    StepType.CUSTOM_SCRIPT: CustomStep,
+}
+
+PLAN_CACHE_SIZE = 256
+
+_PLAN_CACHE: OrderedDict[str, "RecipePlan"] = OrderedDict()
+_PLAN_CACHE_LOCK = Lock()
+
+
+class CompiledStep(BaseModel):
+    """
+    A step validated once at compile time.
+
+    `template` is never executed directly, `bind` hands out a copy of it with
+    the runtime fields (page, cwd, logger...) of the current run. The copy
+    shares the template's parameters, `parse_parameters` replaces them instead
+    of modifying them.
+    """
+
+    index: int
+    step_type: StepType
+    template: Step
+
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
+    @property
+    def needs_page(self) -> bool:
+        return self.step_type == StepType.PLAYWRIGHT
+
+    def bind(self, **runtime_fields) -> Step:
+        return self.template.model_copy(update=runtime_fields)
+
+
+class RecipePlan(BaseModel):
+    """
+    The immutable execution plan of a recipe's steps.
+    """
+
+    key: str
+    steps: tuple[CompiledStep, ...]
+    use_playwright: bool
+
+    model_config = ConfigDict(frozen=True)
+
+    @classmethod
+    def compile(
+        cls,
+        steps: list[dict[str, any]],
+        runtime_fields: Callable[[StepType], dict[str, any]],
+    ) -> "RecipePlan":
+        """
+        Validate the raw step dicts into a plan, or return the cached plan of a
+        recipe with the same steps.
+
+        :param steps: The raw steps of the recipe.
+        :param runtime_fields: Returns the runtime fields needed to validate a
+            step of the given type. Those fields are replaced on `bind`, so a
+            cached plan can be shared by recipes with different configs.
+        """
+        key = plan_key(steps)
+
+        with _PLAN_CACHE_LOCK:
+            plan = _PLAN_CACHE.get(key)
+
+            if plan is not None:
+                _PLAN_CACHE.move_to_end(key)
+                return plan
+
+        compiled_steps: list[CompiledStep] = []
+
+        for index, step_data in enumerate(steps):
+            step_type = StepType(step_data["step_type"])
+            step_class = STEP_CLASSES[step_type]
+
+            template = step_class(**step_data, **runtime_fields(step_type))
+
+            compiled_steps.append(
+                CompiledStep(index=index, step_type=step_type, template=template)
+            )
+
+        plan = cls(
+            key=key,
+            steps=tuple(compiled_steps),
+            use_playwright=any(step.needs_page for step in compiled_steps),
+        )
+
+        with _PLAN_CACHE_LOCK:
+            _PLAN_CACHE[key] = plan
+
+            while len(_PLAN_CACHE) > PLAN_CACHE_SIZE:
+                _PLAN_CACHE.popitem(last=False)
+
+        return plan
+
+
+def plan_key(steps: list[dict[str, any]]) -> str:
+    """
+    Content hash of the raw steps of a recipe.
+    """
+    content = json.dumps(steps, sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
@@ -0,0 +1,272 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+
+from pydantic import BaseModel
+
+# Profiler of the process, set by `enable_profiler`
+PROFILER: "Profiler | None" = None
+
+# CPU times measured on other threads for the innermost span, see `in_thread`
+_OFFLOADED_CPU: ContextVar[list[float] | None] = ContextVar(
+    "offloaded_cpu", default=None
+)
+
+
+class ProfileSpan(BaseModel):
+    name: str
+    category: str
+    start: float  # in seconds, since the profiler was created
+    wall: float  # in seconds
+    cpu: float  # in seconds, CPU time of the thread(s) running the span
+    # In bytes, peak memory of the whole process since it started, not of the
+    # span: it only tells when the process reached its peak
+    process_peak_rss: int | None = None
+    tid: int
+    pid: int | None = None  # set on the spans of other processes, see `merge`
+    args: dict[str, str] = {}
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time and process peak RSS of the phases of a
+    run (store load, recipe load, template render, browser launch and every
+    step), and exports them as Chrome trace events (chrome://tracing, Perfetto)
+    or as a summary table.
+
+    The CPU time is the one of the thread running the span, plus the time of
+    the functions it hands to other threads through `in_thread`. Spans of
+    asyncio tasks only count the latter: the event loop thread runs the other
+    tasks in between.
+    """
+
+    def __init__(self):
+        self.spans: list[ProfileSpan] = []
+        self._origin = time.perf_counter()
+        self._origin_time = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        offloaded: list[float] = []
+        token = _OFFLOADED_CPU.set(offloaded)
+
+        try:
+            yield
+        finally:
+            _OFFLOADED_CPU.reset(token)
+            cpu = sum(offloaded)
+
+            if not _in_task():
+                cpu += time.thread_time() - cpu_start
+
+            span = ProfileSpan(
+                name=name,
+                category=category,
+                start=start - self._origin,
+                wall=time.perf_counter() - start,
+                cpu=cpu,
+                process_peak_rss=_peak_rss(),
+                tid=_current_tid(),
+                args={key: str(value) for key, value in args.items()},
+            )
+
+            with self._lock:
+                self.spans.append(span)
+
+    def drain(self) -> list[ProfileSpan]:
+        """
+        Remove and return the recorded spans, tagged with this process id and
+        timed from the epoch, so another process can `merge` them.
+        """
+        with self._lock:
+            spans, self.spans = self.spans, []
+
+        pid = os.getpid()
+
+        return [
+            span.model_copy(
+                update={"start": span.start + self._origin_time, "pid": pid}
+            )
+            for span in spans
+        ]
+
+    def merge(self, spans: list[ProfileSpan]) -> None:
+        """
+        Add the spans drained from another process, e.g. a course worker.
+        """
+        with self._lock:
+            self.spans.extend(
+                span.model_copy(update={"start": span.start - self._origin_time})
+                for span in spans
+            )
+
+    def to_chrome_trace(self) -> dict[str, any]:
+        pid = os.getpid()
+        events = []
+
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": span.start * 1e6,
+                    "dur": span.wall * 1e6,
+                    "pid": span.pid or pid,
+                    "tid": span.tid,
+                    "args": {
+                        **span.args,
+                        "cpu_ms": round(span.cpu * 1000, 3),
+                        "process_peak_rss_mb": (
+                            round(span.process_peak_rss / 1024 / 1024, 1)
+                            if span.process_peak_rss is not None
+                            else None
+                        ),
+                    },
+                }
+            )
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summary(self) -> str:
+        lines = [
+            (
+                f"{'Span':<40}  {'Category':<10}  {'Wall (s)':>9}  {'CPU (s)':>9}  "
+                f"{'Process peak RSS (MB)':>21}"
+            )
+        ]
+
+        for span in sorted(self.spans, key=lambda span: span.wall, reverse=True):
+            peak_rss = (
+                f"{span.process_peak_rss / 1024 / 1024:>21.1f}"
+                if span.process_peak_rss is not None
+                else f"{'-':>21}"
+            )
+            lines.append(
+                f"{span.name[:40]:<40}  {span.category:<10}  {span.wall:>9.3f}  "
+                f"{span.cpu:>9.3f}  {peak_rss}"
+            )
+
+        return "\n".join(lines)
+
+
+def enable_profiler() -> Profiler:
+    global PROFILER
+
+    PROFILER = Profiler()
+
+    return PROFILER
+
+
+def profile(name: str, category: str, **args):
+    """
+    Context manager recording a span with the process profiler, a no-op when
+    profiling isn't enabled.
+    """
+    if PROFILER is None:
+        return nullcontext()
+
+    return PROFILER.span(name, category, **args)
+
+
+def in_thread(function: Callable) -> Callable:
+    """
+    Wrap a function the current span runs on another thread (e.g. with
+    `run_in_executor`) so its CPU time is counted in the span.
+    """
+    offloaded = _OFFLOADED_CPU.get()
+
+    if offloaded is None:
+        return function
+
+    def run(*args, **kwargs):
+        cpu_start = time.thread_time()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            offloaded.append(time.thread_time() - cpu_start)
+
+    return run
+
+
+def _in_task() -> bool:
+    import asyncio
+
+    try:
+        return asyncio.current_task() is not None
+    except RuntimeError:
+        return False
+
+
+def _current_tid() -> int:
+    # Steps of the async engine share the event loop thread, give each task its
+    # own track so overlapping steps don't end up nested in the trace
+    import asyncio
+
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+
+    return id(task) if task else threading.get_ident()
+
+
+def _peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_peak_rss() -> int | None:
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+
+        ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        )
+    except (AttributeError, OSError):
+        return None
+
+    return counters.PeakWorkingSetSize if ok else None
@@ -1,16 +1,33 @@
 from datetime import datetime
+from functools import cached_property
 import json
 from logging import Logger
 from pathlib import Path
 from pydantic import BaseModel, ConfigDict
 
-from models.config import Config
-from models.step.custom_step import CustomStep
+from models.browser_pool import AsyncBrowserPool, BrowserPool
+from models.checkpoint import Checkpoint
+from models.config import Config, PacingMode
+from models.output_store import OutputStore, OutputStoreConfig
+from models.plan import RecipePlan
+from models.profiler import profile
+from models.step_cache import StepCache, StepCacheConfig
+from models.step.custom_step import CustomConfig, CustomStep
 from models.step.fs_step import FsConfig, FsStep
+from models.step.playwright_network import (
+    apply_network_config,
+    apply_network_config_async,
+)
+from models.step.playwright_replay import (
+    apply_replay_config,
+    apply_replay_config_async,
+)
 from models.step.playwright_step import PlayWrightConfig, PlaywrightStep
 from models.step.step import Step, StepType
 
-from playwright.sync_api import Page
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.async_api import Page as AsyncPage
+from playwright.sync_api import BrowserContext, Page
 
 
 class RecipeMetadata(BaseModel):
@@ -29,10 +46,28 @@ class Recipe(BaseModel):
 
     @property
     def use_playwright(self) -> bool:
-        for step in self.steps:
-            if step.get("step_type") == StepType.PLAYWRIGHT.value:
-                return True
-        return False
+        return self.plan.use_playwright
+
+    @cached_property
+    def plan(self) -> RecipePlan:
+        """
+        The compiled steps of the recipe, shared with every recipe that has the
+        same steps.
+        """
+        with profile("recipe compile", "load", recipe=self.metadata.name):
+            return RecipePlan.compile(self.steps, runtime_fields=self._runtime_fields)
+
+    def validate(self) -> RecipePlan:
+        """
+        Compile the steps, raising a `ValueError` (pydantic's `ValidationError`
+        included) or a `KeyError` on invalid ones. The plan is cached, so
+        cooking the recipe doesn't compile them again.
+        """
+        return self.plan
+
+    @cached_property
+    def step_cache(self) -> StepCache:
+        return StepCache(self.config.step_cache, logger=self.logger)
 
     def __post_init__(self):
         self.logger = self.logger.getChild(self.metadata.name)
@@ -70,92 +105,603 @@ class Recipe(BaseModel):
 
             data["config"] = config
 
-        data["config"] = Config(**data["config"])
+        with profile(
+            "recipe load", "load", recipe=data.get("metadata", {}).get("name")
+        ):
+            data["config"] = Config(**data["config"])
 
-        return cls(
-            **data,
-            logger=logger if logger else Logger("RecipeLogger"),
-        )
+            return cls(
+                **data,
+                logger=logger if logger else Logger("RecipeLogger"),
+            )
 
     def get_step(self, index: int, page: Page | None = None) -> Step:
-        step_data = self.steps[index]
-        step_type = StepType(step_data["step_type"])
+        compiled_step = self.plan.steps[index]
+
+        return compiled_step.bind(**self._runtime_fields(compiled_step.step_type, page))
+
+    def _runtime_fields(
+        self, step_type: StepType, page: Page | None = None
+    ) -> dict[str, any]:
         match step_type:
             case StepType.PLAYWRIGHT:
-                from models.step.playwright_step import PlaywrightStep
+                playwright_config = self.config.playwright_config
+
+                return {
+                    "page": page,
+                    "screen_shot_path": playwright_config.screen_shot_path,
+                    "default_timeout": playwright_config.default_timeout,
+                }
+            case StepType.FS:
+                return {"cwd": self.config.fs_config.cwd}
+            case StepType.CUSTOM_SCRIPT:
+                return {
+                    "logger": self.logger,
+                    "custom_config": self.config.custom_config,
+                }
+
+    def cook(
+        self, pool: BrowserPool | None = None, resume: Checkpoint | None = None
+    ) -> None:
+        """
+        Cook the recipe. Playwright recipes get a new browser, or a fresh
+        context from `pool` when the recipe is cooked as part of a course.
+
+        :param resume: Checkpoint of a failed run of this recipe, the steps it
+            completed are skipped and their outputs restored.
+        """
+        checkpoint = resume if resume else self._new_checkpoint()
+        self.logger.info(f"Run id: {checkpoint.run_id}")
+
+        if not self.use_playwright:
+            self._cook(checkpoint=checkpoint)
+            checkpoint.delete()
+            return
 
-                return PlaywrightStep.with_config(
-                    self.config.playwright_config,
-                    page=page,
-                    **step_data,
+        playwright_config = self.config.playwright_config
+        context_options = self._context_options(checkpoint)
+
+        if pool is not None:
+            with pool.new_context(
+                headless=playwright_config.headless, **context_options
+            ) as context:
+                self._cook(
+                    page=self._new_page(context, checkpoint), checkpoint=checkpoint
                 )
+                self._save_storage_state(context)
 
-            case StepType.FS:
-                from models.step.fs_step import FsStep
+            checkpoint.delete()
+            return
 
-                return FsStep.with_config(self.config.fs_config, **step_data)
-            case StepType.CUSTOM_SCRIPT:
-                from models.step.custom_step import CustomStep
+        from playwright.sync_api import sync_playwright
 
-                return CustomStep(**step_data, logger=self.logger)
+        with sync_playwright() as p:
+            with profile("browser launch", "browser"):
+                browser = p.chromium.launch(headless=playwright_config.headless)
+                context = browser.new_context(**context_options)
+
+            try:
+                self._cook(
+                    page=self._new_page(context, checkpoint), checkpoint=checkpoint
+                )
+                self._save_storage_state(context)
+            finally:
+                # Closing the context writes the HAR recorded by the replay
+                context.close()
+                browser.close()
+
+        checkpoint.delete()
+
+    async def cook_async(
+        self, pool: AsyncBrowserPool | None = None, resume: Checkpoint | None = None
+    ) -> None:
+        """
+        Same as `cook`, but runs on the event loop with `playwright.async_api`
+        so several recipes can be cooked concurrently in one process.
+        """
+        checkpoint = resume if resume else self._new_checkpoint()
+        self.logger.info(f"Run id: {checkpoint.run_id}")
 
-    def cook(self) -> None:
         if not self.use_playwright:
-            self._cook()
+            await self._cook_async(checkpoint=checkpoint)
+            checkpoint.delete()
             return
 
-        from playwright.sync_api import sync_playwright
+        playwright_config = self.config.playwright_config
+        context_options = self._context_options(checkpoint)
 
+        if pool is not None:
+            async with pool.new_context(
+                headless=playwright_config.headless, **context_options
+            ) as context:
+                page = await self._new_page_async(context, checkpoint)
+                await self._cook_async(page=page, checkpoint=checkpoint)
+                await self._save_storage_state_async(context)
+
+            checkpoint.delete()
+            return
+
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            with profile("browser launch", "browser"):
+                browser = await p.chromium.launch(headless=playwright_config.headless)
+                context = await browser.new_context(**context_options)
+
+            try:
+                page = await self._new_page_async(context, checkpoint)
+                await self._cook_async(page=page, checkpoint=checkpoint)
+                await self._save_storage_state_async(context)
+            finally:
+                # Closing the context writes the HAR recorded by the replay
+                await context.close()
+                await browser.close()
+
+        checkpoint.delete()
+
+    def _new_checkpoint(self) -> Checkpoint:
+        return Checkpoint.new(
+            self.metadata.name,
+            recipe=self.model_dump(
+                mode="json", include={"metadata", "steps", "config"}
+            ),
+        )
+
+    def _context_options(self, checkpoint: Checkpoint) -> dict[str, any]:
+        if checkpoint.storage_state_path:
+            return {"storage_state": checkpoint.storage_state_path}
+
+        storage_state_path = self.config.playwright_config.storage_state_path
+
+        if storage_state_path and Path(storage_state_path).exists():
+            self.logger.info(f"Loading storage state from {storage_state_path}")
+            return {"storage_state": str(storage_state_path)}
+
+        return {}
+
+    def _save_storage_state(self, context: BrowserContext) -> None:
         playwright_config = self.config.playwright_config
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=playwright_config.headless)
-            page = browser.new_page()
 
-            self._cook(page=page)
+        if (
+            playwright_config.storage_state_path
+            and playwright_config.save_storage_state
+        ):
+            Path(playwright_config.storage_state_path).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            context.storage_state(path=playwright_config.storage_state_path)
 
-            browser.close()
+    async def _save_storage_state_async(self, context: AsyncBrowserContext) -> None:
+        playwright_config = self.config.playwright_config
 
-    def _cook(self, page: Page | None = None) -> None:
-        current_step: Step
+        if (
+            playwright_config.storage_state_path
+            and playwright_config.save_storage_state
+        ):
+            Path(playwright_config.storage_state_path).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            await context.storage_state(path=playwright_config.storage_state_path)
+
+    def _new_page(self, context: BrowserContext, checkpoint: Checkpoint) -> Page:
+        playwright_config = self.config.playwright_config
+
+        apply_replay_config(context, playwright_config.replay, self.logger)
+        apply_network_config(context, playwright_config.network)
+
+        page = context.new_page()
+
+        # Resumed run, go back to where the failed run was
+        if checkpoint.url:
+            page.goto(checkpoint.url)
+
+        return page
+
+    async def _new_page_async(
+        self, context: AsyncBrowserContext, checkpoint: Checkpoint
+    ) -> AsyncPage:
+        playwright_config = self.config.playwright_config
+
+        await apply_replay_config_async(context, playwright_config.replay, self.logger)
+        await apply_network_config_async(context, playwright_config.network)
+
+        page = await context.new_page()
+
+        if checkpoint.url:
+            await page.goto(checkpoint.url)
+
+        return page
+
+    def _cook(self, checkpoint: Checkpoint, page: Page | None = None) -> None:
+        if self.config.parallel_steps > 1:
+            self._cook_parallel(checkpoint=checkpoint, page=page)
+            return
 
-        params: dict[str, any] = {}
+        current_step: Step
 
         for step_index in range(len(self.steps)):
+            if step_index in checkpoint.completed:
+                continue
+
             current_step = self.get_step(step_index, page=page)
-            self.logger.info(f"Executing step {step_index + 1}/{len(self.steps)}...")
-            self.logger.info(
-                f"Step type: {current_step.step_type.value} - {current_step.description}"
-            )
+            self._log_step_start(step_index, current_step)
 
             try:
-                current_step.parse_parameters(params)
+                if current_step.should_skip(checkpoint.params):
+                    self._log_step_skip(step_index, current_step)
+                    self._complete_step(step_index, current_step, None, checkpoint)
+                    continue
 
-                if isinstance(current_step, FsStep):
-                    result = current_step.execute(self.config.fs_config)
-                else:
-                    result = current_step.execute()
+                current_step.parse_parameters(checkpoint.params)
 
-                if result:
-                    params.update({current_step.name: result})
+                result = self._execute_step(current_step)
 
-                self.logger.info(f"Step {step_index + 1} completed.")
+                self._complete_step(step_index, current_step, result, checkpoint)
             except Exception as e:
-                if isinstance(current_step, PlaywrightStep):
-                    screenshot_path = (
-                        Path(self.config.cwd)
-                        / f"step_{step_index + 1}_error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                    )
-                    current_step.page.screenshot(path=screenshot_path)
-                    self.logger.error(
-                        f"Screenshot of the error saved at: {screenshot_path}"
-                    )
-                self.logger.error(f"Step {step_index + 1} failed with error: {e}")
+                self._handle_step_error(step_index, current_step, e, checkpoint)
                 raise e
 
-            if self.config.slow_mode > 0:
-                import time
+    def _cook_parallel(self, checkpoint: Checkpoint, page: Page | None = None) -> None:
+        """
+        Run the steps as a dependency graph (see `models.scheduler`), executing
+        independent FS and CUSTOM_SCRIPT steps on a bounded thread pool.
+
+        Playwright steps run on the calling thread because the sync Playwright
+        objects can't be used from another thread, and they stay serialized
+        since they all share the same page.
+        """
+        from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+        from models.scheduler import step_dependencies
+
+        dependencies = step_dependencies(self.steps)
+        waiting: dict[int, set[int]] = {
+            index: deps - set(checkpoint.completed)
+            for index, deps in enumerate(dependencies)
+            if index not in checkpoint.completed
+        }
+        running: dict[Future, tuple[int, Step]] = {}
+
+        def complete(step_index: int, step: Step, result: any) -> None:
+            self._complete_step(step_index, step, result, checkpoint)
+
+            for deps in waiting.values():
+                deps.discard(step_index)
+
+        with ThreadPoolExecutor(max_workers=self.config.parallel_steps) as executor:
+            try:
+                while waiting or running:
+                    ready = sorted(index for index, deps in waiting.items() if not deps)
+
+                    for step_index in ready:
+                        del waiting[step_index]
+
+                        current_step = self.get_step(step_index, page=page)
+                        self._log_step_start(step_index, current_step)
+
+                        try:
+                            if current_step.should_skip(checkpoint.params):
+                                self._log_step_skip(step_index, current_step)
+                                complete(step_index, current_step, None)
+                                continue
+
+                            current_step.parse_parameters(checkpoint.params)
+
+                            if isinstance(current_step, PlaywrightStep):
+                                result = self._execute_step(current_step)
+                                complete(step_index, current_step, result)
+                                continue
+                        except Exception as e:
+                            self._handle_step_error(
+                                step_index, current_step, e, checkpoint
+                            )
+                            raise
+
+                        future = executor.submit(self._execute_step, current_step)
+                        running[future] = (step_index, current_step)
+
+                    if not running:
+                        continue
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        step_index, current_step = running.pop(future)
+
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            self._handle_step_error(
+                                step_index, current_step, e, checkpoint
+                            )
+                            raise
+
+                        complete(step_index, current_step, result)
+            except Exception:
+                # Don't start anything new, the steps already running are
+                # awaited when leaving the executor block
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    async def _cook_async(
+        self, checkpoint: Checkpoint, page: AsyncPage | None = None
+    ) -> None:
+        """
+        Async counterpart of `_cook` and `_cook_parallel`. With `parallel_steps`
+        the steps run as a dependency graph, bounded by a semaphore instead of a
+        thread pool.
+        """
+        import asyncio
+
+        from models.scheduler import step_dependencies
+
+        async def run_step(step_index: int) -> None:
+            current_step = self.get_step(step_index, page=page)
+            self._log_step_start(step_index, current_step)
+
+            try:
+                if current_step.should_skip(checkpoint.params):
+                    self._log_step_skip(step_index, current_step)
+                    self._complete_step(step_index, current_step, None, checkpoint)
+                    return
+
+                current_step.parse_parameters(checkpoint.params)
+
+                result = await self._execute_step_async(current_step)
+
+                self._complete_step(step_index, current_step, result, checkpoint)
+            except Exception as e:
+                await self._handle_step_error_async(
+                    step_index, current_step, e, checkpoint
+                )
+                raise
+
+        pending = [
+            step_index
+            for step_index in range(len(self.steps))
+            if step_index not in checkpoint.completed
+        ]
+
+        if self.config.parallel_steps <= 1:
+            for step_index in pending:
+                await run_step(step_index)
+
+            return
+
+        dependencies = step_dependencies(self.steps)
+        finished = [asyncio.Event() for _ in self.steps]
+        semaphore = asyncio.Semaphore(self.config.parallel_steps)
+
+        for step_index in checkpoint.completed:
+            finished[step_index].set()
+
+        async def run_when_ready(step_index: int) -> None:
+            for dep in dependencies[step_index]:
+                await finished[dep].wait()
+
+            async with semaphore:
+                await run_step(step_index)
+
+            finished[step_index].set()
+
+        tasks = [
+            asyncio.create_task(run_when_ready(step_index)) for step_index in pending
+        ]
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _complete_step(
+        self, step_index: int, step: Step, result: any, checkpoint: Checkpoint
+    ) -> None:
+        self._output_store(checkpoint).put(step_index, step.name, result)
+
+        checkpoint.completed.append(step_index)
+
+        if self.config.checkpoint and self.config.checkpoint_every_step:
+            self._save_checkpoint(checkpoint)
+
+        self.logger.info(f"Step {step_index + 1} completed.")
+
+    def _save_checkpoint(self, checkpoint: Checkpoint) -> None:
+        checkpoint.recipe["config"] = self.config.model_dump(mode="json")
+        unsaved = checkpoint.save()
+
+        if unsaved:
+            self.logger.warning(
+                f"The outputs of {', '.join(sorted(unsaved))} can't be saved in "
+                "the checkpoint, these steps run again on resume."
+            )
+
+    def _output_store(self, checkpoint: Checkpoint) -> OutputStore:
+        """
+        The store of the step outputs of the run, created on the first
+        completed step. The outputs of a resumed run that only completed steps
+        read are freed right away.
+        """
+        from models.scheduler import output_readers
+
+        if checkpoint._output_store is None:
+            readers = output_readers(self.steps)
+
+            for indexes in readers.values():
+                indexes.difference_update(checkpoint.completed)
+
+            checkpoint._output_store = OutputStore(
+                self.config.output_store,
+                outputs=checkpoint.params,
+                blob_dir=checkpoint.blob_dir,
+                readers=readers,
+            )
+
+            if self.config.output_store.free_unreferenced:
+                for name, indexes in readers.items():
+                    if not indexes:
+                        checkpoint._output_store.free(name)
+
+        return checkpoint._output_store
+
+    def _execute_step(self, step: Step) -> dict[str, any] | None:
+        cache_key = self._cache_key(step)
+
+        if cache_key:
+            hit, result = self.step_cache.get(cache_key)
+
+            if hit:
+                self.logger.info(f"Step '{step.name}' output served from cache.")
+                return result
+
+        with profile(
+            step.name, "step", step_type=step.step_type.value, action=step.action.value
+        ):
+            if isinstance(step, FsStep):
+                result = step.execute(self.config.fs_config)
+            else:
+                result = step.execute()
+
+        if cache_key:
+            self.step_cache.put(cache_key, result)
+
+        self._pace(step)
+
+        return result
+
+    async def _execute_step_async(self, step: Step) -> dict[str, any] | None:
+        cache_key = self._cache_key(step)
+
+        if cache_key:
+            hit, result = self.step_cache.get(cache_key)
+
+            if hit:
+                self.logger.info(f"Step '{step.name}' output served from cache.")
+                return result
+
+        with profile(
+            step.name, "step", step_type=step.step_type.value, action=step.action.value
+        ):
+            if isinstance(step, FsStep):
+                result = await step.execute_async(self.config.fs_config)
+            else:
+                result = await step.execute_async()
 
-                time.sleep(self.config.slow_mode / 1000)
+        if cache_key:
+            self.step_cache.put(cache_key, result)
+
+        await self._pace_async(step)
+
+        return result
+
+    def _pace(self, step: Step) -> None:
+        if self.config.slow_mode <= 0:
+            return
+
+        if self.config.pacing == PacingMode.ADAPTIVE:
+            # Only the browser needs time to catch up
+            if isinstance(step, PlaywrightStep):
+                step.settle(self.config.slow_mode)
+
+            return
+
+        import time
+
+        time.sleep(self.config.slow_mode / 1000)
+
+    async def _pace_async(self, step: Step) -> None:
+        import asyncio
+
+        if self.config.slow_mode <= 0:
+            return
+
+        if self.config.pacing == PacingMode.ADAPTIVE:
+            if isinstance(step, PlaywrightStep):
+                await step.settle_async(self.config.slow_mode)
+
+            return
+
+        await asyncio.sleep(self.config.slow_mode / 1000)
+
+    def _cache_key(self, step: Step) -> str | None:
+        """
+        Step result cache key of the step, None when it isn't cached.
+        """
+        if not step.cache:
+            return None
+
+        if not step.cacheable:
+            self.logger.warning(f"Step '{step.name}' can't be cached, ignoring cache.")
+            return None
+
+        return self.step_cache.key(step)
+
+    def _log_step_start(self, step_index: int, step: Step) -> None:
+        self.logger.info(f"Executing step {step_index + 1}/{len(self.steps)}...")
+        self.logger.info(f"Step type: {step.step_type.value} - {step.description}")
+
+    def _log_step_skip(self, step_index: int, step: Step) -> None:
+        self.logger.info(f"Step {step_index + 1} skipped, '{step.skip_if}' is set.")
+
+    def _handle_step_error(
+        self, step_index: int, step: Step, error: Exception, checkpoint: Checkpoint
+    ) -> None:
+        if isinstance(step, PlaywrightStep):
+            screenshot_path = self._error_screenshot_path(step_index)
+            step.page.screenshot(path=screenshot_path)
+            self.logger.error(f"Screenshot of the error saved at: {screenshot_path}")
+
+            if self.config.checkpoint:
+                checkpoint.storage_state_path = str(
+                    checkpoint.default_storage_state_path
+                )
+                checkpoint.url = step.page.url
+                step.page.context.storage_state(path=checkpoint.storage_state_path)
+
+        self.logger.error(f"Step {step_index + 1} failed with error: {error}")
+        self._save_failed_checkpoint(step_index, error, checkpoint)
+
+    async def _handle_step_error_async(
+        self, step_index: int, step: Step, error: Exception, checkpoint: Checkpoint
+    ) -> None:
+        if isinstance(step, PlaywrightStep):
+            screenshot_path = self._error_screenshot_path(step_index)
+            await step.page.screenshot(path=screenshot_path)
+            self.logger.error(f"Screenshot of the error saved at: {screenshot_path}")
+
+            if self.config.checkpoint:
+                checkpoint.storage_state_path = str(
+                    checkpoint.default_storage_state_path
+                )
+                checkpoint.url = step.page.url
+                await step.page.context.storage_state(
+                    path=checkpoint.storage_state_path
+                )
+
+        self.logger.error(f"Step {step_index + 1} failed with error: {error}")
+        self._save_failed_checkpoint(step_index, error, checkpoint)
+
+    def _save_failed_checkpoint(
+        self, step_index: int, error: Exception, checkpoint: Checkpoint
+    ) -> None:
+        if not self.config.checkpoint:
+            # Nothing to resume from, drop the spilled outputs
+            checkpoint.delete()
+            return
+
+        checkpoint.failed_step = step_index
+        checkpoint.error = str(error)
+        self._save_checkpoint(checkpoint)
+
+        self.logger.error(
+            f"Resume from the failed step with: single-dish --resume {checkpoint.run_id}"
+        )
+
+    def _error_screenshot_path(self, step_index: int) -> Path:
+        return (
+            Path(self.config.cwd)
+            / f"step_{step_index + 1}_error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+        )
 
     @staticmethod
     def create_template_file() -> dict[str, any]:
@@ -167,9 +713,15 @@ class Recipe(BaseModel):
             },
             "config": {
                 "slow_mode": 0,
+                "pacing": PacingMode.FIXED.value,
                 "cwd": ".",
+                "parallel_steps": 0,
+                "checkpoint": True,
                 "playwright_config": PlayWrightConfig.to_sample_dict(),
                 "fs_config": FsConfig.to_sample_dict(),
+                "custom_config": CustomConfig.to_sample_dict(),
+                "step_cache": StepCacheConfig.to_sample_dict(),
+                "output_store": OutputStoreConfig.to_sample_dict(),
             },
             "steps": [
                 PlaywrightStep.to_sample_dict(),
@@ -0,0 +1,90 @@
+from models.step.fs_step import FsStepAction
+from models.step.parameter_resolver import parameter_references, reference_step
+from models.step.step import StepType
+
+
+def step_dependencies(steps: list[dict[str, any]]) -> list[set[int]]:
+    """
+    Build the dependency graph of a recipe.
+
+    Returns, for every step, the indexes of the earlier steps it has to wait for.
+    A step depends on:
+
+    - every step whose output it reads through `parameter_paths`
+    - every step listed in its `depends_on`
+    - the step whose output its `skip_if` reads
+    - the previous Playwright step, since all of them share the same page
+    - the last SET_CWD step, which changes the working directory for the
+      steps after it and therefore waits for every step before it
+    """
+    dependencies: list[set[int]] = []
+    name_to_index: dict[str, int] = {}
+    last_playwright: int | None = None
+    last_barrier: int | None = None
+
+    for index, step_data in enumerate(steps):
+        step_name = step_data.get("name")
+        deps: set[int] = set()
+
+        for ref in step_references(step_data):
+            if ref not in name_to_index:
+                raise ValueError(
+                    f"Step '{step_name}' depends on unknown or later step '{ref}'."
+                )
+            deps.add(name_to_index[ref])
+
+        step_type = StepType(step_data["step_type"])
+
+        if step_type == StepType.PLAYWRIGHT:
+            if last_playwright is not None:
+                deps.add(last_playwright)
+            last_playwright = index
+
+        if (
+            step_type == StepType.FS
+            and step_data.get("action") == FsStepAction.SET_CWD.value
+        ):
+            start = last_barrier if last_barrier is not None else 0
+            deps.update(range(start, index))
+            last_barrier = index
+        elif last_barrier is not None:
+            deps.add(last_barrier)
+
+        dependencies.append(deps)
+        name_to_index[step_name] = index
+
+    return dependencies
+
+
+def step_references(step_data: dict[str, any]) -> set[str]:
+    """
+    Return the names of the steps referenced by a raw step dict, through the
+    values pointed at by `parameter_paths`, `depends_on` or `skip_if`.
+    """
+    refs: set[str] = set(step_data.get("depends_on") or [])
+
+    if step_data.get("skip_if"):
+        refs.add(reference_step(step_data["skip_if"]))
+
+    refs.update(
+        parameter_references(
+            step_data.get("parameters", {}), step_data.get("parameter_paths") or []
+        )
+    )
+
+    return refs
+
+
+def output_readers(steps: list[dict[str, any]]) -> dict[str, set[int]]:
+    """
+    For every step name, the indexes of the steps that read its output through
+    `parameter_paths`, `depends_on` or `skip_if`. An output none of them still
+    has to read can be freed.
+    """
+    readers: dict[str, set[int]] = {step.get("name"): set() for step in steps}
+
+    for index, step_data in enumerate(steps):
+        for ref in step_references(step_data):
+            readers.setdefault(ref, set()).add(index)
+
+    return readers
@@ -1,12 +1,55 @@
 from enum import Enum
 from logging import Logger
+from pathlib import Path
 from string import Template
+from pydantic import BaseModel
+
+from models.step.script_cache import default_script_cache_dir
+from models.step.script_pool import (
+    evaluate_script,
+    evaluate_script_in_process,
+    map_items,
+    run_in_process,
+)
 from models.step.step import Step, StepType
 
 
 class CustomStepAction(Enum):
     EVAL = "EVAL"
     PRINT = "PRINT"
+    MAP = "MAP"
+
+
+class ScriptExecutor(Enum):
+    INLINE = "INLINE"  # in the thread running the step
+    PROCESS = "PROCESS"  # in a warm pool of worker processes
+
+
+class CustomConfig(BaseModel):
+    # Run the `exec_scripts` once per process and share the definitions they
+    # leave between every run and step, unless they read `params`. Only for
+    # scripts without side effects or mutable state, off by default.
+    prepared_scopes: bool = False
+    # Also keep the compiled scripts on disk for the next processes
+    disk_cache: bool = False
+    cache_dir: Path | None = None  # defaults to the store directory
+    process_workers: int | None = None  # size of the process pool, CPU count
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {
+            "prepared_scopes": False,
+            "disk_cache": False,
+            "cache_dir": None,
+            "process_workers": None,
+        }
+
+    @property
+    def code_cache_dir(self) -> Path | None:
+        if not self.disk_cache:
+            return None
+
+        return Path(self.cache_dir) if self.cache_dir else default_script_cache_dir()
 
 
 class CustomStep(Step):
@@ -17,6 +60,10 @@ class CustomStep(Step):
 
     action: CustomStepAction
     logger: Logger
+    custom_config: CustomConfig = CustomConfig()
+    executor: ScriptExecutor = ScriptExecutor.INLINE
+    timeout: float | None = None  # in seconds, PROCESS executor only
+    memory_limit_mb: int | None = None  # PROCESS executor only, POSIX only
 
     @staticmethod
     def to_sample_dict():
@@ -37,12 +84,19 @@ class CustomStep(Step):
 
         return sample
 
+    @property
+    def cacheable(self) -> bool:
+        # PRINT only has a side effect
+        return self.action != CustomStepAction.PRINT
+
     def execute(self):
         match self.action:
             case CustomStepAction.EVAL:
                 return self._eval()
             case CustomStepAction.PRINT:
                 return self._print()
+            case CustomStepAction.MAP:
+                return self._map()
 
     def _print(self):
         message: str = self.parameters.get("message")
@@ -60,20 +114,76 @@ class CustomStep(Step):
         step_params: dict[str, any] = self.parameters.get("params", {})
         exec_scripts: list[str] = self.parameters.get("exec_scripts")
 
-        scope = {}
-
         # This parameters list will get evaluated in the script
         params: list[any] = [param for _, param in step_params.items()]
 
-        scope["params"] = params
-
-        if exec_scripts:
-            exec_expression = "\n".join(exec_scripts)
-            exec(exec_expression, scope)
-
         eval_str: str = self.parameters.get("script", "")
 
-        if eval_str:
-            return {"result": eval(eval_str, scope)}
+        if not eval_str:
+            raise ValueError("No script provided for execution.")
+
+        kwargs = {
+            "script": eval_str,
+            "exec_scripts": exec_scripts,
+            "params": params,
+            "prepared_scopes": self.custom_config.prepared_scopes,
+            "cache_dir": self.custom_config.code_cache_dir,
+        }
+
+        if self.executor == ScriptExecutor.PROCESS:
+            result = evaluate_script_in_process(
+                kwargs,
+                timeout=self.timeout,
+                memory_limit_mb=self.memory_limit_mb,
+                max_workers=self.custom_config.process_workers,
+            )
+        else:
+            result = evaluate_script(**kwargs)
+
+        return {"result": result}
+
+    def _map(self):
+        """
+        Apply `expression` to every element of `items`, available as `item`.
+        With the PROCESS executor the items are split into chunks of
+        `chunk_size` mapped in parallel by the process pool.
+        """
+        import os
+
+        items: list[any] = self.parameters.get("items")
+        expression: str = self.parameters.get("expression")
+        step_params: dict[str, any] = self.parameters.get("params", {})
+
+        if items is None or not expression:
+            raise ValueError("Missing items or expression to map.")
+
+        kwargs = {
+            "expression": expression,
+            "exec_scripts": self.parameters.get("exec_scripts"),
+            "params": [param for _, param in step_params.items()],
+            "prepared_scopes": self.custom_config.prepared_scopes,
+            "cache_dir": self.custom_config.code_cache_dir,
+            "vectorize": self.parameters.get("vectorize", False),
+        }
+
+        if self.executor != ScriptExecutor.PROCESS:
+            return {"result": map_items(items=list(items), **kwargs)}
+
+        workers = self.custom_config.process_workers or os.cpu_count()
+        # A few chunks per worker keeps them busy when chunks are uneven
+        chunk_size: int = self.parameters.get(
+            "chunk_size", max(1, -(-len(items) // (workers * 4)))
+        )
+        chunks = [
+            list(items[start : start + chunk_size])
+            for start in range(0, len(items), chunk_size)
+        ]
+
+        results = run_in_process(
+            [(map_items, {"items": chunk, **kwargs}) for chunk in chunks],
+            timeout=self.timeout,
+            memory_limit_mb=self.memory_limit_mb,
+            max_workers=self.custom_config.process_workers,
+        )
 
-        raise ValueError("No script provided for execution.")
+        return {"result": [result for chunk in results for result in chunk]}
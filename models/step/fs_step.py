@@ -1,12 +1,51 @@
+from collections.abc import Iterable, Iterator
 from enum import Enum
 import os
 import fnmatch
 from pathlib import Path
+import re
 
 from pydantic import BaseModel
 
 from models.step.step import Step, StepType
 
+# Files deleted per thread pool task by BULK_DELETE_FILES
+BULK_DELETE_BATCH_SIZE = 256
+
+SYNC_INDEX_DIRNAME = "homecook_sync_index"
+
+# Marks the FileHandle dicts in the step outputs
+FILE_HANDLE_KEY = "__file_handle__"
+
+# `compression` parameter of ZIP_FILE to zipfile constant names
+ZIP_COMPRESSION = {
+    "stored": "ZIP_STORED",
+    "deflated": "ZIP_DEFLATED",
+    "bzip2": "ZIP_BZIP2",
+    "lzma": "ZIP_LZMA",
+}
+
+# Already compressed formats, compressing them again only costs time
+ZIP_STORE_PATTERNS = [
+    "*.zip",
+    "*.gz",
+    "*.tgz",
+    "*.bz2",
+    "*.xz",
+    "*.7z",
+    "*.rar",
+    "*.jpg",
+    "*.jpeg",
+    "*.png",
+    "*.gif",
+    "*.webp",
+    "*.mp3",
+    "*.mp4",
+    "*.mkv",
+    "*.mov",
+    "*.avi",
+]
+
 
 class FsStepAction(Enum):
     SET_CWD = "SET_CWD"
@@ -21,6 +60,7 @@ class FsStepAction(Enum):
     DELETE_DIRECTORY = "DELETE_DIRECTORY"
     UNZIP_FILE = "UNZIP_FILE"
     ZIP_FILE = "ZIP_FILE"
+    SYNC_DIRECTORY = "SYNC_DIRECTORY"
 
 
 class FsConfig(BaseModel):
@@ -31,6 +71,58 @@ class FsConfig(BaseModel):
         return {"cwd": str(Path(".").resolve())}
 
 
+class FileHandle(BaseModel):
+    """
+    Reference to a part of a file, output by READ_FILE instead of contents too
+    large to keep in memory. It is stored in the step outputs as a plain dict
+    (see `to_output`) so it survives checkpoints and the step cache.
+    """
+
+    path: str
+    offset: int = 0
+    length: int | None = None  # up to the end of the file when None
+    encoding: str | None = None
+    binary: bool = False
+
+    def to_output(self) -> dict[str, any]:
+        return {FILE_HANDLE_KEY: True, **self.model_dump()}
+
+    @classmethod
+    def from_output(cls, value: any) -> "FileHandle | None":
+        if not (isinstance(value, dict) and value.get(FILE_HANDLE_KEY)):
+            return None
+
+        return cls(
+            **{key: item for key, item in value.items() if key != FILE_HANDLE_KEY}
+        )
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        remaining = self.length
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = f.read(size)
+
+                if not chunk:
+                    return
+
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+                yield chunk
+
+    def read(self) -> str | bytes:
+        content = b"".join(self.iter_chunks())
+
+        if self.binary:
+            return content
+
+        return content.decode(self.encoding or _default_encoding())
+
+
 class FsStep(Step):
     """
     A step that performs filesystem operations.
@@ -60,6 +152,27 @@ class FsStep(Step):
 
         return sample
 
+    @property
+    def cacheable(self) -> bool:
+        # A cache hit skips the step, only READ_FILE has no side effect
+        return self.action == FsStepAction.READ_FILE
+
+    def cache_key_data(self) -> dict[str, any]:
+        data = super().cache_key_data()
+        data["cwd"] = str(self.cwd.resolve())
+        data["input_files"] = {
+            str(path): _hash_path(path) for path in self._input_paths()
+        }
+
+        return data
+
+    def _input_paths(self) -> list[Path]:
+        match self.action:
+            case FsStepAction.READ_FILE:
+                return [self.cwd / self.parameters["file_path"]]
+
+        return []
+
     def execute(self, config: FsConfig):
         match self.action:
             case FsStepAction.SET_CWD:
@@ -88,6 +201,8 @@ class FsStep(Step):
                 return self._unzip_file()
             case FsStepAction.ZIP_FILE:
                 return self._zip_file()
+            case FsStepAction.SYNC_DIRECTORY:
+                return self._sync_directory()
 
     def _create_file(self):
         value: str = self.parameters.get("value", "")
@@ -105,6 +220,19 @@ class FsStep(Step):
             file_path.unlink()
 
     def _bulk_delete_files(self):
+        """
+        Delete the files listed in `files_path`, or the files of `root_dir`
+        matching `include_patterns`, not listed in `exclude_files` (literal
+        names) and matching none of `exclude_patterns`, walking sub-directories
+        with `recursive`.
+
+        Matches are streamed from `os.scandir` into batches deleted on a thread
+        pool, so huge directories are never listed in memory at once. Patterns
+        containing a `/` match the path relative to `root_dir`, the others the
+        file name. With `dry_run` nothing is deleted, only counted.
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
         root_dir = self.parameters.get("root_dir")
 
         if root_dir is None:
@@ -114,28 +242,64 @@ class FsStep(Step):
             root_dir = self.cwd / root_dir
 
         files: list[str] = self.parameters.get("files_path")
+        dry_run: bool = self.parameters.get("dry_run", False)
+        workers: int = self.parameters.get(
+            "workers", min(32, (os.cpu_count() or 1) + 4)
+        )
 
         if files:
-            for file in files:
-                delete_file = root_dir / file
+            matches = (
+                (str(root_dir / file), (root_dir / file).stat().st_size)
+                for file in files
+            )
+        else:
+            matches = _scan_files(
+                root_dir,
+                include=self.parameters.get("include_patterns") or ["*"],
+                exclude=self.parameters.get("exclude_patterns") or [],
+                recursive=self.parameters.get("recursive", False),
+                exclude_names=set(self.parameters.get("exclude_files") or []),
+            )
 
-                delete_file.unlink()
+        deleted_files = 0
+        freed_bytes = 0
 
-            return
+        if dry_run:
+            for _, size in matches:
+                deleted_files += 1
+                freed_bytes += size
 
-        exclude_files: list[str] = self.parameters.get("exclude_files")
-        exclude_patterns: list[str] = self.parameters.get("exclude_patterns")
+            return {
+                "deleted_files": deleted_files,
+                "freed_bytes": freed_bytes,
+                "dry_run": True,
+            }
 
-        for file in root_dir.iterdir():
-            if exclude_files and file.name in exclude_files:
-                continue
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
 
-            if exclude_patterns and any(
-                (fnmatch.fnmatch(pattern, file.name)) for pattern in exclude_patterns
-            ):
-                continue
+            for batch in _batches(matches, BULK_DELETE_BATCH_SIZE):
+                pending.add(executor.submit(_delete_files, batch))
+
+                # Bound the batches in flight so the scan doesn't run ahead
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
 
-            file.unlink()
+                    for future in done:
+                        count, size = future.result()
+                        deleted_files += count
+                        freed_bytes += size
+
+            for future in pending:
+                count, size = future.result()
+                deleted_files += count
+                freed_bytes += size
+
+        return {
+            "deleted_files": deleted_files,
+            "freed_bytes": freed_bytes,
+            "dry_run": False,
+        }
 
     def _move_file(self):
         source_path: Path = self.cwd / self.parameters["source_path"]
@@ -162,21 +326,156 @@ class FsStep(Step):
         raise FileNotFoundError(f"Source file '{source_path}' does not exist.")
 
     def _read_file(self):
+        """
+        Read a file, or the part of it selected by `offset`/`length` (bytes) or
+        `start_line`/`end_line`, as text or with `mode: "binary"` as bytes.
+        With `regex` only the matching lines are returned. `mmap` maps the file
+        instead of reading it, for large files.
+
+        With `inline_limit`, contents larger than that many bytes aren't read:
+        a `FileHandle` to them is returned instead, so they don't stay in
+        memory for the rest of the run. Only WRITE_FILE reads handles.
+        """
         file_path: Path = self.cwd / self.parameters["file_path"]
 
-        if file_path.exists() and file_path.is_file():
-            with open(file_path, "r") as f:
+        if not (file_path.exists() and file_path.is_file()):
+            raise FileNotFoundError(f"File '{file_path}' does not exist.")
+
+        binary: bool = self.parameters.get("mode", "text") == "binary"
+        encoding: str | None = self.parameters.get("encoding")
+        use_mmap: bool = self.parameters.get("mmap", False)
+        inline_limit: int | None = self.parameters.get("inline_limit")
+
+        if self.parameters.get("regex"):
+            return self._grep_file(file_path, encoding, use_mmap)
+
+        offset, length = self._read_range(file_path)
+        ranged = offset > 0 or length is not None
+
+        if length is None:
+            length = max(0, file_path.stat().st_size - offset)
+
+        if inline_limit is not None and length > inline_limit:
+            handle = FileHandle(
+                path=str(file_path.resolve()),
+                offset=offset,
+                length=length,
+                encoding=None if binary else encoding,
+                binary=binary,
+            )
+
+            return {"content": handle.to_output(), "size": length}
+
+        if not binary and not ranged and not use_mmap:
+            with open(file_path, "r", encoding=encoding) as f:
                 content = f.read()
-            return {"content": content}
+            return {"content": content, "size": length}
+
+        content = _read_bytes(file_path, offset, length, use_mmap)
 
-        raise FileNotFoundError(f"File '{file_path}' does not exist.")
+        if not binary:
+            content = content.decode(encoding or _default_encoding())
+
+        return {"content": content, "size": length}
+
+    def _read_range(self, file_path: Path) -> tuple[int, int | None]:
+        """
+        The byte offset and length of the part of the file to read, length being
+        None up to the end of the file.
+        """
+        start_line: int | None = self.parameters.get("start_line")
+        end_line: int | None = self.parameters.get("end_line")
+
+        if start_line is None and end_line is None:
+            return self.parameters.get("offset", 0), self.parameters.get("length")
+
+        # Line numbers are 1-based and `end_line` is included
+        start_line = start_line or 1
+        start = None
+        position = 0
+
+        with open(file_path, "rb") as f:
+            for number, line in enumerate(f, start=1):
+                if number == start_line:
+                    start = position
+
+                position += len(line)
+
+                if end_line is not None and number >= end_line:
+                    break
+
+        if start is None:
+            return position, 0
+
+        return start, position - start
+
+    def _grep_file(
+        self, file_path: Path, encoding: str | None, use_mmap: bool
+    ) -> dict[str, any]:
+        regex: str = self.parameters["regex"]
+        max_matches: int | None = self.parameters.get("max_matches")
+        matches: list[str] = []
+
+        if use_mmap and file_path.stat().st_size > 0:
+            import mmap
+
+            encoding = encoding or _default_encoding()
+            pattern = re.compile(regex.encode(encoding), re.MULTILINE)
+
+            with (
+                open(file_path, "rb") as f,
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            ):
+                next_line = 0
+
+                for match in pattern.finditer(mapped):
+                    # Another match on a line already returned
+                    if match.start() < next_line:
+                        continue
+
+                    line_start = mapped.rfind(b"\n", 0, match.start()) + 1
+                    line_end = mapped.find(b"\n", match.end())
+                    if line_end == -1:
+                        line_end = len(mapped)
+
+                    matches.append(
+                        mapped[line_start:line_end].decode(encoding).rstrip("\r")
+                    )
+                    next_line = line_end + 1
+
+                    if max_matches and len(matches) >= max_matches:
+                        break
+        else:
+            pattern = re.compile(regex)
+
+            with open(file_path, "r", encoding=encoding) as f:
+                for line in f:
+                    if pattern.search(line):
+                        matches.append(line.rstrip("\n"))
+
+                        if max_matches and len(matches) >= max_matches:
+                            break
+
+        return {"matches": matches, "match_count": len(matches)}
 
     def _write_file(self):
-        value: str = self.parameters.get("value", "")
+        """
+        Write `value` to the file: text, bytes or the content of a `FileHandle`
+        (e.g. a large READ_FILE output), streamed in chunks.
+        """
+        value: str | bytes | dict[str, any] = self.parameters.get("value", "")
         file_path: Path = self.cwd / self.parameters["file_path"]
+        handle = FileHandle.from_output(value)
 
-        with open(file_path, "w") as f:
-            f.write(value)
+        if handle is not None:
+            with open(file_path, "wb") as f:
+                f.writelines(handle.iter_chunks())
+        elif isinstance(value, bytes):
+            with open(file_path, "wb") as f:
+                f.write(value)
+        else:
+            with open(file_path, "w") as f:
+                f.write(value)
 
         return {"file_path": self._get_current_rel(file_path)}
 
@@ -194,29 +493,533 @@ class FsStep(Step):
             shutil.rmtree(dir_path)
 
     def _unzip_file(self):
+        """
+        Extract the archive, or only its members matching the `members`
+        patterns, on `workers` threads each reading its own handle of the
+        archive. Members are streamed to disk in chunks.
+        """
         import zipfile
+        from concurrent.futures import ThreadPoolExecutor
 
         zip_path: Path = self.cwd / self.parameters["zip_path"]
         extract_to: Path = self.cwd / self.parameters["extract_to"]
+        patterns: list[str] | None = self.parameters.get("members")
+        workers: int = self.parameters.get("workers", 1)
 
         with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(extract_to)
+            members = [
+                info
+                for info in zip_ref.infolist()
+                if not patterns
+                or any(fnmatch.fnmatch(info.filename, pattern) for pattern in patterns)
+            ]
+
+            if workers <= 1:
+                for member in members:
+                    zip_ref.extract(member, extract_to)
+
+                return {
+                    "extracted_to": self._get_current_rel(extract_to),
+                    "extracted_files": len(members),
+                }
+
+        # Concurrent extractions would race to create the same directories
+        for member in members:
+            target = _member_path(extract_to, member.filename)
+            (target if member.is_dir() else target.parent).mkdir(
+                parents=True, exist_ok=True
+            )
+
+        def extract(group: list[zipfile.ZipInfo]) -> None:
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                for member in group:
+                    zip_ref.extract(member, extract_to)
+
+        # Spread the largest members first so the groups end up balanced
+        groups: list[list[zipfile.ZipInfo]] = [[] for _ in range(workers)]
+        for index, member in enumerate(
+            sorted(members, key=lambda member: member.compress_size, reverse=True)
+        ):
+            groups[index % workers].append(member)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(extract, groups))
 
-        return {"extracted_to": self._get_current_rel(extract_to)}
+        return {
+            "extracted_to": self._get_current_rel(extract_to),
+            "extracted_files": len(members),
+        }
 
     def _zip_file(self):
+        """
+        Archive the files, directories (recursively) and globs of `file_paths`,
+        named after their path relative to the working directory. Files are
+        streamed into the archive, so memory stays constant whatever their
+        size. Files matching `store_patterns` are already compressed and are
+        stored as is.
+        """
         import zipfile
 
-        file_paths: list[Path] = [
-            self.cwd / Path(p) for p in self.parameters["file_paths"]
-        ]
+        file_paths = _expand_paths(self.cwd, self.parameters["file_paths"])
         zip_path: Path = self.cwd / self.parameters["zip_path"]
+        compression_name: str = self.parameters.get("compression", "deflated")
+        compression_level: int | None = self.parameters.get("compression_level")
+        store_patterns: list[str] = self.parameters.get(
+            "store_patterns", ZIP_STORE_PATTERNS
+        )
+
+        if compression_name not in ZIP_COMPRESSION:
+            raise ValueError(f"Unsupported compression: {compression_name}")
 
-        with zipfile.ZipFile(zip_path, "w") as zip_ref:
+        compression = getattr(zipfile, ZIP_COMPRESSION[compression_name])
+        resolved_zip_path = zip_path.resolve()
+
+        with zipfile.ZipFile(
+            zip_path, "w", compression=compression, compresslevel=compression_level
+        ) as zip_ref:
             for file_path in file_paths:
-                zip_ref.write(file_path, arcname=file_path.name)
+                # A glob may match the archive being written
+                if file_path.resolve() == resolved_zip_path:
+                    continue
+
+                compress_type = (
+                    zipfile.ZIP_STORED
+                    if any(
+                        fnmatch.fnmatch(file_path.name, pattern)
+                        for pattern in store_patterns
+                    )
+                    else compression
+                )
+
+                zip_ref.write(
+                    file_path,
+                    arcname=self._arcname(file_path),
+                    compress_type=compress_type,
+                    compresslevel=compression_level,
+                )
+
+        return {
+            "zip_path": self._get_current_rel(zip_path),
+            "file_count": len(file_paths),
+        }
+
+    def _sync_directory(self):
+        """
+        Mirror `source_dir` into `destination_dir`, copying only the new and
+        changed files on `workers` threads (`shutil.copy2` uses the kernel's
+        copy fast paths). Files are compared by size and modification time
+        (within `mtime_tolerance` seconds),
+        or by content with `compare: "hash"`, in which case the hashes are
+        kept in an index so unchanged files aren't hashed again. With
+        `delete_extra` the destination files missing from the source are
+        deleted.
+        """
+        import shutil
+        from concurrent.futures import ThreadPoolExecutor
+
+        source_dir: Path = self.cwd / self.parameters["source_dir"]
+        destination_dir: Path = self.cwd / self.parameters["destination_dir"]
+        compare: str = self.parameters.get("compare", "mtime")
+        delete_extra: bool = self.parameters.get("delete_extra", False)
+        dry_run: bool = self.parameters.get("dry_run", False)
+        mtime_tolerance: float = self.parameters.get("mtime_tolerance", 0)
+        workers: int = self.parameters.get(
+            "workers", min(32, (os.cpu_count() or 1) + 4)
+        )
+
+        if compare not in ("mtime", "hash"):
+            raise ValueError(f"Unsupported comparison: {compare}")
+
+        if not source_dir.is_dir():
+            raise FileNotFoundError(f"Source directory '{source_dir}' does not exist.")
+
+        index = (
+            SyncIndex.load(source_dir, destination_dir) if compare == "hash" else None
+        )
+
+        source_files: set[str] = set()
+        to_copy: list[tuple[Path, Path, int]] = []
+        skipped_files = 0
+
+        for path, size in _scan_files(
+            source_dir,
+            include=self.parameters.get("include_patterns") or ["*"],
+            exclude=self.parameters.get("exclude_patterns") or [],
+            recursive=True,
+        ):
+            source = Path(path)
+            rel_path = source.relative_to(source_dir).as_posix()
+            destination = destination_dir / rel_path
+            source_files.add(rel_path)
+
+            if _is_synced(source, destination, rel_path, index, mtime_tolerance):
+                skipped_files += 1
+            else:
+                to_copy.append((source, destination, size))
 
-        return {"zip_path": self._get_current_rel(zip_path)}
+        deleted_files = 0
+
+        if delete_extra and destination_dir.is_dir():
+            exclude: list[str] = self.parameters.get("exclude_patterns") or []
+            extra_files = [
+                Path(path)
+                # Excluded files are left alone on both sides, like rsync
+                for path, _ in _scan_files(
+                    destination_dir,
+                    include=["*"],
+                    exclude=exclude,
+                    recursive=True,
+                )
+                if Path(path).relative_to(destination_dir).as_posix()
+                not in source_files
+            ]
+            deleted_files = len(extra_files)
+
+            if not dry_run:
+                for path in extra_files:
+                    path.unlink()
+
+                    if index:
+                        index.forget(path.relative_to(destination_dir).as_posix())
+
+                _remove_emptied_dirs(destination_dir, extra_files, exclude)
+
+        if not dry_run:
+
+            def copy(item: tuple[Path, Path, int]) -> None:
+                source, destination, _ = item
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(source, destination)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(copy, to_copy))
+
+            if index:
+                for source, destination, _ in to_copy:
+                    index.record_copy(
+                        source.relative_to(source_dir).as_posix(), source, destination
+                    )
+
+                index.save()
+
+        return {
+            "copied_files": len(to_copy),
+            "copied_bytes": sum(size for _, _, size in to_copy),
+            "skipped_files": skipped_files,
+            "deleted_files": deleted_files,
+            "dry_run": dry_run,
+        }
+
+    def _arcname(self, file_path: Path) -> str:
+        try:
+            return file_path.resolve().relative_to(self.cwd.resolve()).as_posix()
+        except ValueError:
+            # Outside the working directory
+            return file_path.name
 
     def _get_current_rel(self, current_path: Path):
         return str(os.path.relpath(current_path, self.cwd))
+
+
+def _hash_path(path: Path) -> str | None:
+    """
+    Content hash of a file, or of the relative paths and contents of every file
+    under a directory.
+    """
+    import hashlib
+
+    if not path.exists():
+        return None
+
+    digest = hashlib.sha256()
+
+    if path.is_file():
+        files = [(path, "")]
+    else:
+        files = [
+            (file, file.relative_to(path).as_posix())
+            for file in sorted(path.rglob("*"))
+            if file.is_file()
+        ]
+
+    for file, rel_path in files:
+        digest.update(rel_path.encode())
+
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _scan_files(
+    root_dir: Path,
+    include: list[str],
+    exclude: list[str],
+    recursive: bool,
+    exclude_names: set[str] = frozenset(),
+) -> Iterator[tuple[str, int]]:
+    """
+    Stream the paths and sizes of the files under `root_dir` matching one of
+    the `include` patterns and none of the `exclude` ones, nor named (or at a
+    relative path) literally in `exclude_names`. Excluded directories aren't
+    walked. Symlinks are never followed.
+    """
+    stack = [root_dir]
+
+    while stack:
+        directory = stack.pop()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                rel_path = Path(entry.path).relative_to(root_dir).as_posix()
+
+                if (
+                    entry.name in exclude_names
+                    or rel_path in exclude_names
+                    or _matches(entry.name, rel_path, exclude)
+                ):
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(Path(entry.path))
+                    continue
+
+                if _matches(entry.name, rel_path, include):
+                    yield entry.path, entry.stat(follow_symlinks=False).st_size
+
+
+def _matches(name: str, rel_path: str, patterns: list[str]) -> bool:
+    return any(
+        fnmatch.fnmatch(rel_path if "/" in pattern else name, pattern)
+        for pattern in patterns
+    )
+
+
+def _member_path(extract_to: Path, filename: str) -> Path:
+    """
+    Where `ZipFile.extract` writes an archive member: absolute paths, drives
+    and `..` components are dropped, so it never lands outside `extract_to`.
+    """
+    arcname = filename.replace("/", os.path.sep)
+
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+
+    arcname = os.path.splitdrive(arcname)[1]
+    parts = [
+        part
+        for part in arcname.split(os.path.sep)
+        if part not in ("", os.path.curdir, os.path.pardir)
+    ]
+
+    return extract_to.joinpath(*parts)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _delete_files(files: list[tuple[str, int]]) -> tuple[int, int]:
+    deleted_files = 0
+    freed_bytes = 0
+
+    for path, size in files:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+
+        deleted_files += 1
+        freed_bytes += size
+
+    return deleted_files, freed_bytes
+
+
+def _expand_paths(cwd: Path, patterns: list[str]) -> list[Path]:
+    """
+    The files designated by a list of paths relative to `cwd`: files as is,
+    directories recursively and globs (`*`, `**`) expanded.
+    """
+    files: list[Path] = []
+
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            matches = sorted(cwd.glob(pattern))
+        else:
+            matches = [cwd / pattern]
+
+        for path in matches:
+            if path.is_dir():
+                files.extend(sorted(file for file in path.rglob("*") if file.is_file()))
+            else:
+                files.append(path)
+
+    # A file matched by several patterns is archived once
+    return list(dict.fromkeys(files))
+
+
+class SyncIndex:
+    """
+    Content hashes of the files synced by SYNC_DIRECTORY, with the size and
+    modification time they were hashed at, persisted in the store directory.
+    A file whose size and modification time didn't change since is not hashed
+    again.
+    """
+
+    def __init__(self, path: Path, entries: dict[str, dict[str, any]]):
+        self.path = path
+        self.entries = entries
+
+    @classmethod
+    def load(cls, source_dir: Path, destination_dir: Path) -> "SyncIndex":
+        import hashlib
+        import json
+
+        from models.store import get_store_dir
+
+        key = hashlib.sha256(
+            f"{source_dir.resolve()}\n{destination_dir.resolve()}".encode()
+        ).hexdigest()
+        path = get_store_dir() / SYNC_INDEX_DIRNAME / f"{key}.json"
+
+        try:
+            with open(path, "r") as f:
+                return cls(path, json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return cls(path, {})
+
+    def hash(self, rel_path: str, side: str, path: Path) -> str | None:
+        """
+        Content hash of the `side` ("source" or "destination") copy of a file.
+        """
+        stat = path.stat()
+        entry = self.entries.setdefault(rel_path, {}).get(side)
+
+        if (
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return entry["hash"]
+
+        digest = _hash_path(path)
+        self.entries[rel_path][side] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": digest,
+        }
+
+        return digest
+
+    def record_copy(self, rel_path: str, source: Path, destination: Path) -> None:
+        source_digest = self.hash(rel_path, "source", source)
+        stat = destination.stat()
+
+        self.entries[rel_path]["destination"] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": source_digest,
+        }
+
+    def forget(self, rel_path: str) -> None:
+        self.entries.pop(rel_path, None)
+
+    def save(self) -> None:
+        import json
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+
+        os.replace(tmp_path, self.path)
+
+
+def _is_synced(
+    source: Path,
+    destination: Path,
+    rel_path: str,
+    index: SyncIndex | None,
+    mtime_tolerance: float = 0,
+) -> bool:
+    try:
+        destination_stat = destination.stat()
+    except FileNotFoundError:
+        return False
+
+    source_stat = source.stat()
+
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+
+    if index is None:
+        # copy2 preserves the modification time. The tolerance is for file
+        # systems with a coarser resolution (e.g. 2 seconds on FAT), which
+        # would otherwise copy everything again
+        return (
+            abs(source_stat.st_mtime_ns - destination_stat.st_mtime_ns)
+            <= mtime_tolerance * 1e9
+        )
+
+    return index.hash(rel_path, "source", source) == index.hash(
+        rel_path, "destination", destination
+    )
+
+
+def _remove_emptied_dirs(
+    root_dir: Path, deleted_files: list[Path], exclude: list[str]
+) -> None:
+    """
+    Remove the directories left empty by deleting `deleted_files`, up to
+    `root_dir`. Other empty directories and the excluded ones are kept.
+    """
+    directories = {
+        parent
+        for path in deleted_files
+        for parent in path.parents
+        if parent != root_dir and parent.is_relative_to(root_dir)
+    }
+
+    # Deepest first, so a directory emptied by removing its subdirectories goes too
+    for directory in sorted(directories, key=lambda d: len(d.parts), reverse=True):
+        rel_path = directory.relative_to(root_dir).as_posix()
+
+        if not _matches(directory.name, rel_path, exclude) and not any(
+            directory.iterdir()
+        ):
+            directory.rmdir()
+
+
+def _read_bytes(file_path: Path, offset: int, length: int, use_mmap: bool) -> bytes:
+    if length == 0:
+        return b""
+
+    with open(file_path, "rb") as f:
+        if use_mmap:
+            import mmap
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[offset : offset + length]
+
+        f.seek(offset)
+        return f.read(length)
+
+
+def _default_encoding() -> str:
+    import locale
+
+    # The encoding `open` uses in text mode
+    return locale.getpreferredencoding(False)
@@ -0,0 +1,295 @@
+import copy
+import json
+import re
+from collections.abc import Callable
+
+from models.output_store import load_blobs
+
+# `${step.key}` placeholders, with an optional `|default`
+PLACEHOLDER = re.compile(r"\$\{([^}|]+)(?:\|([^}]*))?\}")
+
+# One dotted path segment with its list indexes, e.g. `records[0][-1]`
+_SEGMENT = re.compile(r"([^.\[\]]+)((?:\[-?\d+\])*)")
+_INDEX = re.compile(r"\[(-?\d+)\]")
+
+# Resolve a value from the outputs of the previous steps
+Resolver = Callable[[dict[str, any]], any]
+
+
+def parse_path(path: str) -> list[str | int]:
+    """
+    Split a path like `step.records[0].title` into its keys. Indexes in
+    brackets become ints, a numeric segment like `records.0` stays a str and
+    indexes a list too.
+    """
+    keys: list[str | int] = []
+
+    for segment in path.split("."):
+        match = _SEGMENT.fullmatch(segment.strip())
+
+        if match is None:
+            raise ValueError(f"Invalid path '{path}'.")
+
+        keys.append(match.group(1))
+        keys.extend(int(index) for index in _INDEX.findall(match.group(2)))
+
+    return keys
+
+
+def compile_path(path: str) -> Callable[[any], any]:
+    """
+    Compile a path into a getter, raising `KeyError` when a key is missing.
+    """
+    keys = parse_path(path)
+
+    def get(data: any) -> any:
+        value = data
+
+        for key in keys:
+            try:
+                value = _item(value, key)
+            except (KeyError, IndexError, TypeError, ValueError):
+                raise KeyError(
+                    f"Key '{key}' not found while accessing path '{path}'"
+                ) from None
+
+        return value
+
+    return get
+
+
+def compile_reference(reference: str) -> Resolver:
+    """
+    Compile a `step.key` or `step.key|default` reference. The default is read
+    as JSON when it is valid JSON (`|0`, `|[]`, `|null`), as text otherwise.
+    """
+    path, separator, default = reference.partition("|")
+    get = compile_path(path)
+
+    if not separator:
+        # Outputs spilled to disk by the OutputStore are read back here
+        return lambda outputs: load_blobs(get(outputs))
+
+    default_value = _parse_default(default)
+
+    def resolve(outputs: dict[str, any]) -> any:
+        try:
+            return load_blobs(get(outputs))
+        except KeyError:
+            return default_value
+
+    return resolve
+
+
+def compile_value(value: any) -> Resolver | None:
+    """
+    Compile a parameter pointed at by `parameter_paths`:
+
+    - a string that is a single `${...}` placeholder, or a bare `step.key`
+      path, resolves to the referenced output itself, whatever its type
+    - a string with placeholders among text resolves to the text with every
+      placeholder replaced
+    - in lists and dicts, every string containing placeholders is resolved
+
+    Returns None when there is nothing to resolve.
+    """
+    if isinstance(value, str):
+        whole = PLACEHOLDER.fullmatch(value)
+
+        if whole:
+            return compile_reference(_placeholder_reference(whole))
+
+        if PLACEHOLDER.search(value):
+            return _compile_template(value)
+
+        return compile_reference(value)
+
+    if isinstance(value, (list, dict)):
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        resolvers = {
+            key: _compile_text(item)
+            for key, item in items
+            if isinstance(item, (str, list, dict))
+        }
+        resolvers = {key: r for key, r in resolvers.items() if r is not None}
+
+        if not resolvers:
+            return None
+
+        def resolve(outputs: dict[str, any]) -> any:
+            resolved = copy.copy(value)
+
+            for key, resolver in resolvers.items():
+                resolved[key] = resolver(outputs)
+
+            return resolved
+
+        return resolve
+
+    return None
+
+
+def compile_parameters(
+    parameters: dict[str, any], parameter_paths: list[str]
+) -> Callable[[dict[str, any]], dict[str, any]]:
+    """
+    Compile the `parameter_paths` of a step once into a function returning its
+    resolved parameters.
+
+    Resolution is copy on write: only the dicts and lists leading to a resolved
+    parameter are copied, the rest is shared with `parameters`, and the outputs
+    are inserted as is, without being copied.
+    """
+    resolvers: list[tuple[list[str | int], Resolver]] = []
+
+    for path in parameter_paths:
+        keys = _container_keys(parameters, parse_path(path), path)
+        resolver = compile_value(compile_path(path)(parameters))
+
+        if resolver is not None:
+            resolvers.append((keys, resolver))
+
+    if not resolvers:
+        return lambda outputs: parameters
+
+    def resolve(outputs: dict[str, any]) -> dict[str, any]:
+        resolved = parameters
+
+        for keys, resolver in resolvers:
+            resolved = _replace(resolved, keys, resolver(outputs))
+
+        return resolved
+
+    return resolve
+
+
+def parameter_references(
+    parameters: dict[str, any], parameter_paths: list[str]
+) -> set[str]:
+    """
+    Names of the steps whose outputs the `parameter_paths` refer to.
+    """
+    refs: set[str] = set()
+
+    for path in parameter_paths:
+        refs.update(_value_references(compile_path(path)(parameters)))
+
+    return refs
+
+
+def reference_step(reference: str) -> str:
+    """
+    Name of the step a `step.key|default` reference points at.
+    """
+    return str(parse_path(reference.partition("|")[0])[0])
+
+
+def _value_references(value: any, bare_paths: bool = True) -> set[str]:
+    if isinstance(value, str):
+        placeholders = PLACEHOLDER.finditer(value)
+        refs = {reference_step(_placeholder_reference(p)) for p in placeholders}
+
+        if not refs and bare_paths:
+            refs.add(reference_step(value))
+
+        return refs
+
+    if isinstance(value, (list, dict)):
+        items = value.values() if isinstance(value, dict) else value
+
+        return set().union(*(_value_references(item, False) for item in items))
+
+    return set()
+
+
+def _compile_text(value: any) -> Resolver | None:
+    """
+    Like `compile_value` for the items of a list or dict, where strings without
+    placeholders are kept as is instead of read as paths.
+    """
+    if isinstance(value, str) and not PLACEHOLDER.search(value):
+        return None
+
+    return compile_value(value)
+
+
+def _compile_template(text: str) -> Resolver:
+    parts: list[str | Resolver] = []
+    position = 0
+
+    for placeholder in PLACEHOLDER.finditer(text):
+        parts.append(text[position : placeholder.start()])
+        parts.append(compile_reference(_placeholder_reference(placeholder)))
+        position = placeholder.end()
+
+    parts.append(text[position:])
+
+    def resolve(outputs: dict[str, any]) -> str:
+        return "".join(
+            part if isinstance(part, str) else _to_text(part(outputs)) for part in parts
+        )
+
+    return resolve
+
+
+def _placeholder_reference(placeholder: re.Match) -> str:
+    path, default = placeholder.group(1), placeholder.group(2)
+
+    return path if default is None else f"{path}|{default}"
+
+
+def _parse_default(default: str) -> any:
+    try:
+        return json.loads(default)
+    except json.JSONDecodeError:
+        return default
+
+
+def _to_text(value: any) -> str:
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+
+    return "" if value is None else str(value)
+
+
+def _item(container: any, key: str | int) -> any:
+    if isinstance(container, (list, tuple)):
+        return container[int(key)]
+
+    return container[key]
+
+
+def _container_keys(
+    parameters: dict[str, any], keys: list[str | int], path: str
+) -> list[str | int]:
+    """
+    The keys of a parameter path as used to set the value, with the numeric
+    segments indexing a list converted to ints.
+    """
+    compile_path(path)(parameters)  # raise KeyError on a missing parameter
+
+    container = parameters
+    container_keys: list[str | int] = []
+
+    for key in keys:
+        if isinstance(container, list):
+            key = int(key)
+
+        container_keys.append(key)
+        container = container[key]
+
+    return container_keys
+
+
+def _replace(data: any, keys: list[str | int], value: any) -> any:
+    if not keys:
+        return value
+
+    key, *rest = keys
+    replaced = copy.copy(data)
+    replaced[key] = _replace(data[key], rest, value)
+
+    return replaced
@@ -0,0 +1,72 @@
+import fnmatch
+
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.sync_api import BrowserContext, Request
+from pydantic import BaseModel
+
+
+class NetworkConfig(BaseModel):
+    # Playwright resource types: document, stylesheet, image, media, font,
+    # script, xhr, fetch, websocket...
+    block_resource_types: list[str] = []
+    block_url_patterns: list[str] = []  # globs matched against the full URL
+    extra_http_headers: dict[str, str] = {}
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {
+            "block_resource_types": ["image", "media", "font"],
+            "block_url_patterns": ["*google-analytics.com*"],
+            "extra_http_headers": {},
+        }
+
+    @property
+    def blocks_requests(self) -> bool:
+        return bool(self.block_resource_types or self.block_url_patterns)
+
+    def should_block(self, request: Request) -> bool:
+        if request.resource_type in self.block_resource_types:
+            return True
+
+        return any(
+            fnmatch.fnmatchcase(request.url, pattern)
+            for pattern in self.block_url_patterns
+        )
+
+
+def apply_network_config(context: BrowserContext, config: NetworkConfig) -> None:
+    """
+    Block the requests matched by the config and set the header overrides on
+    every page of the context.
+    """
+    if config.extra_http_headers:
+        context.set_extra_http_headers(config.extra_http_headers)
+
+    if not config.blocks_requests:
+        return
+
+    def handle(route):
+        if config.should_block(route.request):
+            route.abort()
+        else:
+            route.fallback()
+
+    context.route("**/*", handle)
+
+
+async def apply_network_config_async(
+    context: AsyncBrowserContext, config: NetworkConfig
+) -> None:
+    if config.extra_http_headers:
+        await context.set_extra_http_headers(config.extra_http_headers)
+
+    if not config.blocks_requests:
+        return
+
+    async def handle(route):
+        if config.should_block(route.request):
+            await route.abort()
+        else:
+            await route.fallback()
+
+    await context.route("**/*", handle)
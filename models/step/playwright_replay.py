@@ -0,0 +1,318 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from urllib.error import URLError
+
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.async_api import Error as AsyncPlaywrightError
+from playwright.async_api import Route as AsyncRoute
+from playwright.sync_api import BrowserContext, Request, Route
+from pydantic import BaseModel
+
+from models.step_cache import evict_lru_files
+from models.store import get_store_dir
+
+RESPONSE_CACHE_DIRNAME = "homecook_response_cache"
+
+# Headers describing the encoding of the original transfer, the cached body is
+# stored decoded
+_UNCACHED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class ReplayMode(Enum):
+    OFF = "OFF"
+    HAR = "HAR"
+    CACHE = "CACHE"
+
+
+class ReplayConfig(BaseModel):
+    mode: ReplayMode = ReplayMode.OFF
+    # HAR mode: recorded on the first run, replayed on the next ones
+    har_path: Path | None = None
+    har_url_pattern: str | None = None  # glob of the URLs to record and replay
+    har_not_found: str = "fallback"  # "abort" to run fully offline
+    # CACHE mode
+    cache_dir: Path | None = None  # defaults to the store directory
+    url_patterns: list[str] = []  # globs of the URLs to cache, all when empty
+    max_age: int = 3600  # in seconds, served without revalidation
+    stale_while_revalidate: int = 24 * 3600  # in seconds, served then refreshed
+    max_size_mb: int = 256
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {
+            "mode": ReplayMode.OFF.value,
+            "har_path": None,
+            "har_url_pattern": None,
+            "har_not_found": "fallback",
+            "cache_dir": None,
+            "url_patterns": [],
+            "max_age": 3600,
+            "stale_while_revalidate": 24 * 3600,
+            "max_size_mb": 256,
+        }
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET responses served to the browser through a route.
+
+    Fresh entries (younger than `max_age`) are served as is. Stale entries
+    still within `stale_while_revalidate` are served too, then refreshed from
+    the network. Each entry is one file: a JSON header line followed by the
+    body, evicted like the step cache (expired first, then least recently
+    used once the cache outgrows `max_size_mb`).
+    """
+
+    def __init__(self, config: ReplayConfig):
+        self.config = config
+        self.cache_dir = (
+            Path(config.cache_dir)
+            if config.cache_dir
+            else get_store_dir() / RESPONSE_CACHE_DIRNAME
+        )
+        self._lock = Lock()
+
+    def should_cache(self, method: str, url: str) -> bool:
+        if method != "GET":
+            return False
+
+        if not self.config.url_patterns:
+            return True
+
+        return any(
+            fnmatch.fnmatchcase(url, pattern) for pattern in self.config.url_patterns
+        )
+
+    def get(self, url: str) -> tuple[dict[str, any], bytes, bool] | None:
+        """
+        Return the cached metadata, body and whether the entry is stale, or
+        None when there is no usable entry.
+        """
+        path = self._entry_path(url)
+
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        age = time.time() - meta["stored_at"]
+
+        if age > self.config.max_age + self.config.stale_while_revalidate:
+            path.unlink(missing_ok=True)
+            return None
+
+        # The modification time records the last access for the LRU eviction
+        os.utime(path)
+
+        return meta, body, age > self.config.max_age
+
+    def put(self, url: str, status: int, headers: dict[str, str], body: bytes) -> None:
+        if status != 200 or "no-store" in headers.get("cache-control", ""):
+            return
+
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {
+                name: value
+                for name, value in headers.items()
+                if name.lower() not in _UNCACHED_HEADERS
+            },
+            "stored_at": time.time(),
+        }
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        path = self._entry_path(url)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(meta).encode() + b"\n")
+            f.write(body)
+
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            evict_lru_files(
+                self.cache_dir.glob("*.response"),
+                max_size=self.config.max_size_mb * 1024 * 1024,
+                ttl=self.config.max_age + self.config.stale_while_revalidate,
+            )
+
+    def _entry_path(self, url: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.response"
+
+
+def apply_replay_config(
+    context: BrowserContext, config: ReplayConfig, logger: logging.Logger
+) -> None:
+    """
+    Serve the requests of the context from the HAR file or the response cache
+    of the config. Must be applied before `apply_network_config`, so blocked
+    requests are aborted before reaching the replay.
+    """
+    match config.mode:
+        case ReplayMode.OFF:
+            return
+        case ReplayMode.HAR:
+            # The HAR is written when the context closes
+            context.route_from_har(**_har_options(config))
+        case ReplayMode.CACHE:
+            cache = ResponseCache(config)
+            # The sync API can't be used from other threads, stale entries are
+            # refreshed with urllib on these threads instead
+            refresher = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="response_cache"
+            )
+            context.on("close", lambda _: refresher.shutdown(wait=False))
+
+            def refresh(url: str, headers: dict[str, str]):
+                try:
+                    with urllib.request.urlopen(
+                        urllib.request.Request(url, headers=headers)
+                    ) as response:
+                        response_headers = {
+                            name.lower(): value
+                            for name, value in response.headers.items()
+                        }
+                        cache.put(
+                            url, response.status, response_headers, response.read()
+                        )
+                except (URLError, OSError) as e:
+                    logger.warning(f"Could not refresh the cached '{url}': {e}")
+
+            def handle(route: Route):
+                request = route.request
+
+                if not cache.should_cache(request.method, request.url):
+                    route.fallback()
+                    return
+
+                cached = cache.get(request.url)
+
+                if cached is not None:
+                    meta, body, stale = cached
+                    route.fulfill(
+                        status=meta["status"], headers=meta["headers"], body=body
+                    )
+
+                    if stale:
+                        refresher.submit(
+                            refresh, request.url, _refresh_headers(context, request)
+                        )
+                    return
+
+                response = route.fetch()
+                body = response.body()
+                cache.put(request.url, response.status, response.headers, body)
+                route.fulfill(response=response, body=body)
+
+            context.route("**/*", handle)
+
+
+async def apply_replay_config_async(
+    context: AsyncBrowserContext, config: ReplayConfig, logger: logging.Logger
+) -> None:
+    import asyncio
+
+    match config.mode:
+        case ReplayMode.OFF:
+            return
+        case ReplayMode.HAR:
+            await context.route_from_har(**_har_options(config))
+        case ReplayMode.CACHE:
+            cache = ResponseCache(config)
+            refreshes: set[asyncio.Task] = set()
+
+            async def refresh(url: str, headers: dict[str, str]):
+                try:
+                    response = await context.request.get(url, headers=headers)
+                    cache.put(
+                        url, response.status, response.headers, await response.body()
+                    )
+                except AsyncPlaywrightError as e:
+                    # e.g. the context closed first, the entry stays stale
+                    logger.warning(f"Could not refresh the cached '{url}': {e}")
+
+            async def handle(route: AsyncRoute):
+                request = route.request
+
+                if not cache.should_cache(request.method, request.url):
+                    await route.fallback()
+                    return
+
+                cached = cache.get(request.url)
+
+                if cached is not None:
+                    meta, body, stale = cached
+                    await route.fulfill(
+                        status=meta["status"], headers=meta["headers"], body=body
+                    )
+
+                    if stale:
+                        task = asyncio.create_task(
+                            refresh(request.url, request.headers)
+                        )
+                        refreshes.add(task)
+                        task.add_done_callback(refreshes.discard)
+                    return
+
+                response = await route.fetch()
+                body = await response.body()
+                cache.put(request.url, response.status, response.headers, body)
+                await route.fulfill(response=response, body=body)
+
+            await context.route("**/*", handle)
+
+
+def _refresh_headers(context: BrowserContext, request: Request) -> dict[str, str]:
+    """
+    Headers of the request with the cookies of the context, which urllib
+    doesn't send itself. The body is cached decoded, so it's asked uncompressed.
+    """
+    headers = {
+        name: value
+        for name, value in request.headers.items()
+        if name.lower() not in ("accept-encoding", "cookie")
+    }
+    cookies = context.cookies(request.url)
+
+    if cookies:
+        headers["cookie"] = "; ".join(
+            f"{cookie['name']}={cookie['value']}" for cookie in cookies
+        )
+
+    return headers
+
+
+def _har_options(config: ReplayConfig) -> dict[str, any]:
+    if config.har_path is None:
+        raise ValueError("HAR replay requires a 'har_path'.")
+
+    har_path = Path(config.har_path)
+    record = not har_path.exists()
+
+    if record:
+        har_path.parent.mkdir(parents=True, exist_ok=True)
+
+    return {
+        "har": har_path,
+        "url": config.har_url_pattern,
+        "not_found": "fallback" if record else config.har_not_found,
+        "update": record,
+        "update_content": "embed",
+    }
@@ -1,10 +1,75 @@
 from enum import Enum
+import fnmatch
+import json
 from pathlib import Path
+import re
+import time
 from pydantic import BaseModel
 
+from models.step.playwright_network import NetworkConfig
+from models.step.playwright_replay import ReplayConfig
 from models.step.step import Step, StepType
 
-from playwright.sync_api import Page
+from playwright.async_api import Page as AsyncPage
+from playwright.sync_api import Page, Response
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+# Quiet period of the DOM used by the adaptive pacing
+SETTLE_QUIET_MS = 200
+
+# Resolves once no mutation happened under `selector` for `quietMs`. The
+# observer is kept on `window` between polls, `token` identifies the wait it
+# belongs to so a timed out wait doesn't leak into the next one.
+DOM_QUIET_SCRIPT = """
+({ selector, quietMs, token }) => {
+    const root = selector ? document.querySelector(selector) : document;
+    if (!root) return false;
+
+    let state = window.__homecookDomQuiet;
+    if (!state || state.token !== token || state.root !== root) {
+        if (state) state.observer.disconnect();
+        state = { token, root, last: performance.now() };
+        state.observer = new MutationObserver(() => { state.last = performance.now(); });
+        state.observer.observe(root, {
+            subtree: true, childList: true, attributes: true, characterData: true,
+        });
+        window.__homecookDomQuiet = state;
+    }
+
+    if (performance.now() - state.last < quietMs) return false;
+
+    state.observer.disconnect();
+    window.__homecookDomQuiet = null;
+    return true;
+}
+"""
+
+
+# Builds one record per element matched by the row selector, `fields` being the
+# normalized field specs of `_extract_many_fields`
+EXTRACT_MANY_SCRIPT = """
+(rows, { fields, limit }) => {
+    const read = (element, attr) => {
+        if (!element) return null;
+        if (!attr) return element.innerText;
+        return element.getAttribute(attr);
+    };
+
+    return rows.slice(0, limit ?? rows.length).map((row) => {
+        const record = {};
+        for (const { name, selector, attr, all } of fields) {
+            if (all) {
+                const elements = selector ? row.querySelectorAll(selector) : [row];
+                record[name] = Array.from(elements, (element) => read(element, attr));
+            } else {
+                const element = selector ? row.querySelector(selector) : row;
+                record[name] = read(element, attr);
+            }
+        }
+        return record;
+    });
+}
+"""
 
 
 class PlayWrightActionType(Enum):
@@ -19,8 +84,15 @@ class PlayWrightActionType(Enum):
     WAIT_FOR_REQUEST = "WAIT_FOR_REQUEST"
     WAIT_FOR_SELECTOR = "WAIT_FOR_SELECTOR"
     WAIT_AMOUNT_OF_TIME = "WAIT_AMOUNT_OF_TIME"
+    WAIT_FOR_LOAD_STATE = "WAIT_FOR_LOAD_STATE"
+    WAIT_FOR_RESPONSE = "WAIT_FOR_RESPONSE"
+    WAIT_FOR_ELEMENT_STATE = "WAIT_FOR_ELEMENT_STATE"
+    WAIT_FOR_DOM_QUIET = "WAIT_FOR_DOM_QUIET"
     EXTRACT_TEXT = "EXTRACT_TEXT"
     EXTRACT_ATTR = "EXTRACT_ATTR"
+    EXTRACT_MANY = "EXTRACT_MANY"
+    CAPTURE_RESPONSE = "CAPTURE_RESPONSE"
+    CHECK_SESSION = "CHECK_SESSION"
     TAKE_SCREENSHOT = "TAKE_SCREENSHOT"
 
 
@@ -28,6 +100,12 @@ class PlayWrightConfig(BaseModel):
     headless: bool = True
     default_timeout: int = 30000  # in milliseconds
     screen_shot_path: Path
+    # Loaded into the browser context when it exists, saved back after a
+    # successful run so the next runs start logged in
+    storage_state_path: Path | None = None
+    save_storage_state: bool = True
+    network: NetworkConfig = NetworkConfig()
+    replay: ReplayConfig = ReplayConfig()
 
     def __post_init__(self):
         self.screen_shot_path.mkdir(parents=True, exist_ok=True)
@@ -38,6 +116,10 @@ class PlayWrightConfig(BaseModel):
             "headless": True,
             "default_timeout": 30000,
             "screen_shot_path": str(Path("./screenshots").resolve()),
+            "storage_state_path": None,
+            "save_storage_state": True,
+            "network": NetworkConfig.to_sample_dict(),
+            "replay": ReplayConfig.to_sample_dict(),
         }
 
 
@@ -48,13 +130,13 @@ class PlaywrightStep(Step):
 
     action: PlayWrightActionType
     parameters: dict[str, any]
-    page: Page
+    page: Page | AsyncPage | None = None
     screen_shot_path: Path
     default_timeout: int = 30000  # in milliseconds
 
     @classmethod
     def with_config(
-        cls, config: PlayWrightConfig, page: Page, **data
+        cls, config: PlayWrightConfig, page: Page | AsyncPage, **data
     ) -> "PlaywrightStep":
         """Create a PlaywrightStep instance with the provided configuration."""
         return cls(
@@ -64,6 +146,11 @@ class PlaywrightStep(Step):
             default_timeout=config.default_timeout,
         )
 
+    @property
+    def cacheable(self) -> bool:
+        # The output depends on the page state
+        return False
+
     @staticmethod
     def to_sample_dict() -> dict[str, any]:
         """
@@ -103,13 +190,73 @@ class PlaywrightStep(Step):
                 self._wait_for_selector()
             case PlayWrightActionType.WAIT_AMOUNT_OF_TIME:
                 self._wait_amount_of_time()
+            case PlayWrightActionType.WAIT_FOR_LOAD_STATE:
+                self._wait_for_load_state()
+            case PlayWrightActionType.WAIT_FOR_RESPONSE:
+                return self._wait_for_response()
+            case PlayWrightActionType.WAIT_FOR_ELEMENT_STATE:
+                self._wait_for_element_state()
+            case PlayWrightActionType.WAIT_FOR_DOM_QUIET:
+                self._wait_for_dom_quiet()
             case PlayWrightActionType.EXTRACT_TEXT:
                 return self._extract_text()
             case PlayWrightActionType.EXTRACT_ATTR:
                 return self._extract_attr()
+            case PlayWrightActionType.EXTRACT_MANY:
+                return self._extract_many()
+            case PlayWrightActionType.CAPTURE_RESPONSE:
+                return self._capture_response()
+            case PlayWrightActionType.CHECK_SESSION:
+                return self._check_session()
             case PlayWrightActionType.TAKE_SCREENSHOT:
                 self.take_screenshot()
 
+    async def execute_async(self):
+        """
+        Same as `execute`, for a step bound to a `playwright.async_api` page.
+        """
+        match self.action:
+            case PlayWrightActionType.NAVIGATION:
+                await self._navigate_async()
+            case PlayWrightActionType.CLICK:
+                await self._click_async()
+            case PlayWrightActionType.TYPE:
+                await self._type_async()
+            case PlayWrightActionType.SELECT:
+                await self._select_async()
+            case PlayWrightActionType.CHECK:
+                await self._check_async()
+            case PlayWrightActionType.FOCUS:
+                await self._focus_async()
+            case PlayWrightActionType.UPLOAD_FILE:
+                await self._upload_file_async()
+            case PlayWrightActionType.WAIT_FOR_REQUEST:
+                await self._wait_for_request_async()
+            case PlayWrightActionType.WAIT_FOR_SELECTOR:
+                await self._wait_for_selector_async()
+            case PlayWrightActionType.WAIT_AMOUNT_OF_TIME:
+                await self._wait_amount_of_time_async()
+            case PlayWrightActionType.WAIT_FOR_LOAD_STATE:
+                await self._wait_for_load_state_async()
+            case PlayWrightActionType.WAIT_FOR_RESPONSE:
+                return await self._wait_for_response_async()
+            case PlayWrightActionType.WAIT_FOR_ELEMENT_STATE:
+                await self._wait_for_element_state_async()
+            case PlayWrightActionType.WAIT_FOR_DOM_QUIET:
+                await self._wait_for_dom_quiet_async()
+            case PlayWrightActionType.EXTRACT_TEXT:
+                return await self._extract_text_async()
+            case PlayWrightActionType.EXTRACT_ATTR:
+                return await self._extract_attr_async()
+            case PlayWrightActionType.EXTRACT_MANY:
+                return await self._extract_many_async()
+            case PlayWrightActionType.CAPTURE_RESPONSE:
+                return await self._capture_response_async()
+            case PlayWrightActionType.CHECK_SESSION:
+                return await self._check_session_async()
+            case PlayWrightActionType.TAKE_SCREENSHOT:
+                await self.take_screenshot_async()
+
     def take_screenshot(self, filename: str = "screenshot.png"):
         filename: str = self.parameters.get("filename", filename)
         screenshot = self.page.screenshot()
@@ -185,7 +332,10 @@ class PlaywrightStep(Step):
         url: str = self.parameters.get("url")
         timeout: int = self.parameters.get("timeout", self.default_timeout)
         if url:
-            self.page.expect_request(url, timeout=timeout)
+            # Only requests sent after the listener is registered are seen, so
+            # the step triggers them itself
+            with self.page.expect_request(url, timeout=timeout):
+                self._trigger()
 
     def _wait_for_selector(self):
         selector: str = self.parameters.get("selector")
@@ -194,8 +344,190 @@ class PlaywrightStep(Step):
             self.page.wait_for_selector(selector, timeout=timeout)
 
     def _wait_amount_of_time(self):
-        amount: int = self.parameters.get("amount", self.default_timeout)
-        self.page.wait_for_timeout(amount)
+        self.page.wait_for_timeout(self._wait_amount())
+
+    def _wait_amount(self) -> int:
+        amount: int | None = self.parameters.get("amount")
+
+        if amount is None:
+            raise ValueError("Missing amount (in milliseconds) to wait for.")
+
+        return amount
+
+    def _wait_for_load_state(self):
+        state: str = self.parameters.get("state", "networkidle")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        self.page.wait_for_load_state(state, timeout=timeout)
+
+    def _wait_for_response(self) -> dict[str, any]:
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        with self.page.expect_response(
+            self._response_predicate(), timeout=timeout
+        ) as response_info:
+            self._trigger()
+
+        response: Response = response_info.value
+
+        return {"url": response.url, "status": response.status}
+
+    def _capture_response(self) -> dict[str, any]:
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        # The listener is registered before the trigger so a fast response
+        # can't be missed
+        with self.page.expect_response(
+            self._response_predicate(), timeout=timeout
+        ) as response_info:
+            self._trigger()
+
+        response: Response = response_info.value
+
+        return {
+            "url": response.url,
+            "status": response.status,
+            "body": self._response_body(response.headers, response.body()),
+        }
+
+    def _trigger(self):
+        """
+        Navigate to `navigate` or click `click`, the action causing the network
+        traffic a step waits for.
+        """
+        navigate: str | None = self.parameters.get("navigate")
+        click: str | None = self.parameters.get("click")
+
+        if navigate:
+            self.page.goto(navigate)
+        elif click:
+            self.page.click(click)
+
+    def _check_session(self) -> dict[str, bool]:
+        """
+        Check whether the loaded session is still logged in: the `cookie` is
+        set and not expired, the `selector` shows up and the
+        `logged_out_selector` doesn't, after navigating to `url` if given.
+        """
+        url: str | None = self.parameters.get("url")
+        selector: str | None = self.parameters.get("selector")
+        logged_out_selector: str | None = self.parameters.get("logged_out_selector")
+        cookie: str | None = self.parameters.get("cookie")
+        timeout: int = self.parameters.get("timeout", 5000)
+
+        if not (selector or logged_out_selector or cookie):
+            raise ValueError(
+                "Either selector, logged_out_selector or cookie must be provided."
+            )
+
+        if url:
+            self.page.goto(url)
+
+        if cookie and not _has_cookie(self.page.context.cookies(), cookie):
+            return {"valid": False}
+
+        if selector:
+            try:
+                self.page.wait_for_selector(selector, state="attached", timeout=timeout)
+            except PlaywrightTimeoutError:
+                return {"valid": False}
+
+        if logged_out_selector and self.page.query_selector(logged_out_selector):
+            return {"valid": False}
+
+        return {"valid": True}
+
+    def _response_body(self, headers: dict[str, str], body: bytes) -> any:
+        """
+        Decode a captured body according to the `format` parameter: `json`,
+        `text` or `auto` (default, JSON when the content type says so).
+        """
+        body_format: str = self.parameters.get("format", "auto")
+
+        if body_format == "auto":
+            content_type = headers.get("content-type", "")
+            body_format = "json" if "json" in content_type else "text"
+
+        match body_format:
+            case "json":
+                return json.loads(body)
+            case "text":
+                return body.decode(errors="replace")
+            case _:
+                raise ValueError(f"Unsupported response format: {body_format}")
+
+    def _response_predicate(self):
+        """
+        Predicate matching the responses described by the `url` (glob),
+        `url_regex` and `status` parameters.
+        """
+        url: str | None = self.parameters.get("url")
+        url_regex: str | None = self.parameters.get("url_regex")
+        status: int | None = self.parameters.get("status")
+
+        if url is None and url_regex is None:
+            raise ValueError("Either url or url_regex must be provided.")
+
+        def predicate(response) -> bool:
+            if url is not None and not fnmatch.fnmatchcase(response.url, url):
+                return False
+
+            if url_regex is not None and not re.search(url_regex, response.url):
+                return False
+
+            return status is None or response.status == status
+
+        return predicate
+
+    def _wait_for_element_state(self):
+        selector: str = self.parameters.get("selector")
+        state: str = self.parameters.get("state", "visible")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        if not selector:
+            raise ValueError("Missing selector to wait for.")
+
+        if state in ("attached", "detached", "visible", "hidden"):
+            self.page.wait_for_selector(selector, state=state, timeout=timeout)
+            return
+
+        # enabled, disabled, editable and stable are states of an element that
+        # has to be attached first
+        element = self.page.wait_for_selector(
+            selector, state="attached", timeout=timeout
+        )
+        element.wait_for_element_state(state, timeout=timeout)
+
+    def _wait_for_dom_quiet(self):
+        selector: str | None = self.parameters.get("selector")
+        quiet_ms: int = self.parameters.get("quiet_ms", 500)
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        self._wait_until_dom_quiet(selector, quiet_ms, timeout)
+
+    def _wait_until_dom_quiet(self, selector: str | None, quiet_ms: int, timeout: int):
+        self.page.wait_for_function(
+            DOM_QUIET_SCRIPT,
+            arg={"selector": selector, "quietMs": quiet_ms, "token": time.time_ns()},
+            polling=100,
+            timeout=timeout,
+        )
+
+    def settle(self, max_wait: int):
+        """
+        Adaptive pacing: wait until the network is idle and the DOM stopped
+        changing, for at most `max_wait` milliseconds.
+        """
+        deadline = time.monotonic() + max_wait / 1000
+
+        try:
+            self.page.wait_for_load_state("networkidle", timeout=max_wait)
+
+            remaining = int((deadline - time.monotonic()) * 1000)
+            if remaining > 0:
+                self._wait_until_dom_quiet(None, SETTLE_QUIET_MS, remaining)
+        except PlaywrightTimeoutError:
+            pass
 
     def _extract_text(self) -> dict[str, str]:
         selector: str = self.parameters.get("selector")
@@ -220,3 +552,267 @@ class PlaywrightStep(Step):
         raise ValueError(
             "Selector or attr not provided or element not found for text extraction."
         )
+
+    def _extract_many(self) -> dict[str, list[dict[str, any]]]:
+        selector, arg = self._extract_many_args()
+
+        return {
+            "records": self.page.eval_on_selector_all(
+                selector, EXTRACT_MANY_SCRIPT, arg
+            )
+        }
+
+    def _extract_many_args(self) -> tuple[str, dict[str, any]]:
+        """
+        The row selector and the script argument of EXTRACT_MANY. A field is
+        either a selector relative to the row (its text is extracted) or a dict
+        with an optional `selector`, an optional `attr` and `all` to extract
+        every match instead of the first one.
+        """
+        selector: str = self.parameters.get("selector")
+        fields: dict[str, str | dict[str, any]] = self.parameters.get("fields")
+        limit: int | None = self.parameters.get("limit")
+
+        if not selector or not fields:
+            raise ValueError("Missing selector or fields to extract.")
+
+        normalized_fields = []
+
+        for name, field in fields.items():
+            if isinstance(field, str):
+                field = {"selector": field}
+
+            normalized_fields.append(
+                {
+                    "name": name,
+                    "selector": field.get("selector"),
+                    "attr": field.get("attr"),
+                    "all": field.get("all", False),
+                }
+            )
+
+        return selector, {"fields": normalized_fields, "limit": limit}
+
+    async def take_screenshot_async(self, filename: str = "screenshot.png"):
+        filename: str = self.parameters.get("filename", filename)
+
+        await self.page.screenshot(path=self.screen_shot_path / filename)
+
+    async def _navigate_async(self):
+        url: str = self.parameters.get("url")
+        if url:
+            await self.page.goto(url)
+
+    async def _click_async(self):
+        selector: str = self.parameters.get("selector")
+        if selector:
+            await self.page.click(selector)
+
+    async def _type_async(self):
+        selector: str = self.parameters.get("selector")
+        text: str = self.parameters.get("text", "")
+        if selector:
+            await self.page.fill(selector, text)
+
+    async def _select_async(self):
+        selector: str = self.parameters.get("selector")
+        value: str = self.parameters.get("value", "")
+        if selector:
+            await self.page.select_option(selector, value)
+
+    async def _check_async(self):
+        selector: str = self.parameters.get("selector")
+        if selector:
+            await self.page.check(selector)
+
+    async def _focus_async(self):
+        selector: str = self.parameters.get("selector")
+        if selector:
+            await self.page.focus(selector)
+
+    async def _upload_file_async(self):
+        selector: str = self.parameters.get("selector")
+        file_path: str = self.parameters.get("file_path", "")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        if selector and file_path:
+            await self.page.set_input_files(selector, file_path, timeout=timeout)
+
+    async def _wait_for_request_async(self):
+        url: str = self.parameters.get("url")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+        if url:
+            async with self.page.expect_request(url, timeout=timeout):
+                await self._trigger_async()
+
+    async def _wait_for_selector_async(self):
+        selector: str = self.parameters.get("selector")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+        if selector:
+            await self.page.wait_for_selector(selector, timeout=timeout)
+
+    async def _wait_amount_of_time_async(self):
+        await self.page.wait_for_timeout(self._wait_amount())
+
+    async def _wait_for_load_state_async(self):
+        state: str = self.parameters.get("state", "networkidle")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        await self.page.wait_for_load_state(state, timeout=timeout)
+
+    async def _wait_for_response_async(self) -> dict[str, any]:
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        async with self.page.expect_response(
+            self._response_predicate(), timeout=timeout
+        ) as response_info:
+            await self._trigger_async()
+
+        response = await response_info.value
+
+        return {"url": response.url, "status": response.status}
+
+    async def _capture_response_async(self) -> dict[str, any]:
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        async with self.page.expect_response(
+            self._response_predicate(), timeout=timeout
+        ) as response_info:
+            await self._trigger_async()
+
+        response = await response_info.value
+
+        return {
+            "url": response.url,
+            "status": response.status,
+            "body": self._response_body(response.headers, await response.body()),
+        }
+
+    async def _trigger_async(self):
+        navigate: str | None = self.parameters.get("navigate")
+        click: str | None = self.parameters.get("click")
+
+        if navigate:
+            await self.page.goto(navigate)
+        elif click:
+            await self.page.click(click)
+
+    async def _check_session_async(self) -> dict[str, bool]:
+        url: str | None = self.parameters.get("url")
+        selector: str | None = self.parameters.get("selector")
+        logged_out_selector: str | None = self.parameters.get("logged_out_selector")
+        cookie: str | None = self.parameters.get("cookie")
+        timeout: int = self.parameters.get("timeout", 5000)
+
+        if not (selector or logged_out_selector or cookie):
+            raise ValueError(
+                "Either selector, logged_out_selector or cookie must be provided."
+            )
+
+        if url:
+            await self.page.goto(url)
+
+        if cookie and not _has_cookie(await self.page.context.cookies(), cookie):
+            return {"valid": False}
+
+        if selector:
+            try:
+                await self.page.wait_for_selector(
+                    selector, state="attached", timeout=timeout
+                )
+            except PlaywrightTimeoutError:
+                return {"valid": False}
+
+        if logged_out_selector and await self.page.query_selector(logged_out_selector):
+            return {"valid": False}
+
+        return {"valid": True}
+
+    async def _wait_for_element_state_async(self):
+        selector: str = self.parameters.get("selector")
+        state: str = self.parameters.get("state", "visible")
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        if not selector:
+            raise ValueError("Missing selector to wait for.")
+
+        if state in ("attached", "detached", "visible", "hidden"):
+            await self.page.wait_for_selector(selector, state=state, timeout=timeout)
+            return
+
+        element = await self.page.wait_for_selector(
+            selector, state="attached", timeout=timeout
+        )
+        await element.wait_for_element_state(state, timeout=timeout)
+
+    async def _wait_for_dom_quiet_async(self):
+        selector: str | None = self.parameters.get("selector")
+        quiet_ms: int = self.parameters.get("quiet_ms", 500)
+        timeout: int = self.parameters.get("timeout", self.default_timeout)
+
+        await self._wait_until_dom_quiet_async(selector, quiet_ms, timeout)
+
+    async def _wait_until_dom_quiet_async(
+        self, selector: str | None, quiet_ms: int, timeout: int
+    ):
+        await self.page.wait_for_function(
+            DOM_QUIET_SCRIPT,
+            arg={"selector": selector, "quietMs": quiet_ms, "token": time.time_ns()},
+            polling=100,
+            timeout=timeout,
+        )
+
+    async def settle_async(self, max_wait: int):
+        deadline = time.monotonic() + max_wait / 1000
+
+        try:
+            await self.page.wait_for_load_state("networkidle", timeout=max_wait)
+
+            remaining = int((deadline - time.monotonic()) * 1000)
+            if remaining > 0:
+                await self._wait_until_dom_quiet_async(None, SETTLE_QUIET_MS, remaining)
+        except PlaywrightTimeoutError:
+            pass
+
+    async def _extract_text_async(self) -> dict[str, str]:
+        selector: str = self.parameters.get("selector")
+        if selector:
+            element = await self.page.query_selector(selector)
+            if element:
+                return {"text": await element.inner_text()}
+
+        raise ValueError(
+            "Selector not provided or element not found for text extraction."
+        )
+
+    async def _extract_attr_async(self) -> dict[str, str | None]:
+        selector: str = self.parameters.get("selector")
+        attr: str = self.parameters.get("attr")
+
+        if selector and attr:
+            element = await self.page.query_selector(selector)
+            if element:
+                return {"text": await element.get_attribute(attr)}
+
+        raise ValueError(
+            "Selector or attr not provided or element not found for text extraction."
+        )
+
+    async def _extract_many_async(self) -> dict[str, list[dict[str, any]]]:
+        selector, arg = self._extract_many_args()
+
+        return {
+            "records": await self.page.eval_on_selector_all(
+                selector, EXTRACT_MANY_SCRIPT, arg
+            )
+        }
+
+
+def _has_cookie(cookies: list[dict[str, any]], name: str) -> bool:
+    now = time.time()
+
+    # Session cookies have an expiry of -1
+    return any(
+        cookie["name"] == name and (cookie["expires"] < 0 or cookie["expires"] > now)
+        for cookie in cookies
+    )
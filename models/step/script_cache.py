@@ -0,0 +1,109 @@
+import hashlib
+import marshal
+import os
+import sys
+from pathlib import Path
+from threading import Lock
+from types import CodeType
+
+from models.store import get_store_dir
+
+SCRIPT_CACHE_DIRNAME = "homecook_script_cache"
+
+# Process-wide caches, keyed by the hash of the script
+_CODE_CACHE: dict[str, CodeType] = {}
+_SCOPE_CACHE: dict[str, dict[str, any]] = {}
+_LOCK = Lock()
+
+
+def compile_script(source: str, mode: str, cache_dir: Path | None = None) -> CodeType:
+    """
+    Compile a custom script, or return the code already compiled for the same
+    source by this process. With `cache_dir` the code is also kept on disk for
+    the next processes, like `__pycache__`.
+
+    :param mode: "exec" or "eval", as for `compile`.
+    """
+    key = script_key(source, mode)
+    code = _CODE_CACHE.get(key)
+
+    if code is not None:
+        return code
+
+    code = _load_code(cache_dir, key) if cache_dir else None
+
+    if code is None:
+        code = compile(source, f"<custom script {key[:12]}>", mode)
+
+        if cache_dir:
+            _save_code(cache_dir, key, code)
+
+    with _LOCK:
+        return _CODE_CACHE.setdefault(key, code)
+
+
+def prepared_scope(source: str, cache_dir: Path | None = None) -> dict[str, any]:
+    """
+    Globals left by running the `exec_scripts` source, run once per process
+    and shared by every caller. Callers must copy it before adding their own
+    names.
+    """
+    key = script_key(source, "exec")
+
+    with _LOCK:
+        scope = _SCOPE_CACHE.get(key)
+
+    if scope is not None:
+        return scope
+
+    scope = {}
+    exec(compile_script(source, "exec", cache_dir), scope)  # noqa: S102
+
+    with _LOCK:
+        return _SCOPE_CACHE.setdefault(key, scope)
+
+
+def uses_name(code: CodeType, name: str) -> bool:
+    """
+    Whether the code, or a function or class defined in it, refers to `name`.
+    """
+    if name in code.co_names:
+        return True
+
+    return any(
+        uses_name(const, name)
+        for const in code.co_consts
+        if isinstance(const, CodeType)
+    )
+
+
+def script_key(source: str, mode: str) -> str:
+    return hashlib.sha256(f"{mode}\n{source}".encode()).hexdigest()
+
+
+def default_script_cache_dir() -> Path:
+    return get_store_dir() / SCRIPT_CACHE_DIRNAME
+
+
+def _code_path(cache_dir: Path, key: str) -> Path:
+    # The marshal format changes between Python versions
+    return Path(cache_dir) / f"{key}.{sys.implementation.cache_tag}.bin"
+
+
+def _load_code(cache_dir: Path, key: str) -> CodeType | None:
+    try:
+        with open(_code_path(cache_dir, key), "rb") as f:
+            return marshal.load(f)
+    except (FileNotFoundError, EOFError, ValueError, TypeError):
+        return None
+
+
+def _save_code(cache_dir: Path, key: str, code: CodeType) -> None:
+    path = _code_path(cache_dir, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        marshal.dump(code, f)
+
+    os.replace(tmp_path, path)
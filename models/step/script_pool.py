@@ -0,0 +1,240 @@
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+
+from models.step.script_cache import compile_script, prepared_scope, uses_name
+
+# Warm pools shared by every custom step of the process with
+# `executor: "PROCESS"`, one per worker count, created on first use
+_POOLS: dict[int | None, ProcessPoolExecutor] = {}
+_POOL_LOCK = Lock()
+
+
+def evaluate_script(
+    script: str,
+    exec_scripts: list[str] | None,
+    params: list[any],
+    prepared_scopes: bool = False,
+    cache_dir: Path | None = None,
+) -> any:
+    """
+    Evaluate a custom script with `params` and the definitions of its
+    `exec_scripts`, in this process or in a pool worker.
+    """
+    scope = script_scope(exec_scripts, params, prepared_scopes, cache_dir)
+
+    return eval(compile_script(script, "eval", cache_dir), scope)
+
+
+def map_items(
+    expression: str,
+    items: list[any],
+    exec_scripts: list[str] | None,
+    params: list[any],
+    prepared_scopes: bool = False,
+    cache_dir: Path | None = None,
+    vectorize: bool = False,
+) -> list[any]:
+    """
+    Apply an expression of `item` to every item. The expression is compiled
+    once into a function. With `vectorize` and numeric items it is evaluated
+    once over a NumPy array instead, when NumPy is installed and the
+    expression supports arrays.
+    """
+    scope = script_scope(exec_scripts, params, prepared_scopes, cache_dir)
+
+    if vectorize:
+        result = _map_vectorized(expression, items, scope, cache_dir)
+
+        if result is not None:
+            return result
+
+    function = eval(
+        compile_script(f"lambda item: ({expression})", "eval", cache_dir), scope
+    )
+
+    return list(map(function, items))
+
+
+def script_scope(
+    exec_scripts: list[str] | None,
+    params: list[any],
+    prepared_scopes: bool = False,
+    cache_dir: Path | None = None,
+) -> dict[str, any]:
+    """
+    Globals a script is evaluated in: `params` and the definitions of the
+    `exec_scripts`, taken from the prepared scope when they don't depend on
+    `params`.
+    """
+    if not exec_scripts:
+        return {"params": params}
+
+    exec_expression = "\n".join(exec_scripts)
+    code = compile_script(exec_expression, "exec", cache_dir)
+
+    if prepared_scopes and not uses_name(code, "params"):
+        return {**prepared_scope(exec_expression, cache_dir), "params": params}
+
+    scope = {"params": params}
+    exec(code, scope)  # noqa: S102
+
+    return scope
+
+
+def evaluate_script_in_process(
+    kwargs: dict[str, any],
+    timeout: float | None = None,
+    memory_limit_mb: int | None = None,
+    max_workers: int | None = None,
+) -> any:
+    """
+    Run `evaluate_script(**kwargs)` in the warm process pool (see
+    `run_in_process`).
+    """
+    return run_in_process(
+        [(evaluate_script, kwargs)],
+        timeout=timeout,
+        memory_limit_mb=memory_limit_mb,
+        max_workers=max_workers,
+    )[0]
+
+
+def run_in_process(
+    calls: list[tuple[Callable, dict[str, any]]],
+    timeout: float | None = None,
+    memory_limit_mb: int | None = None,
+    max_workers: int | None = None,
+) -> list[any]:
+    """
+    Run the `(function, kwargs)` calls in the warm process pool and return
+    their results in order. A stuck call can't be interrupted, so with
+    `timeout` the calls run in a pool of their own instead, terminated with
+    `TimeoutError` when they haven't returned after `timeout` seconds, without
+    affecting the other steps' calls. That pool is started for the calls, timed
+    calls don't benefit from the warm pool. With `memory_limit_mb` the worker's address
+    space is capped while a call runs (POSIX only), so a runaway script raises
+    `MemoryError` instead of exhausting the machine.
+    """
+    if not calls:
+        return []
+
+    if timeout is not None:
+        return _run_timed(calls, timeout, memory_limit_mb, max_workers)
+
+    pool = _pool(max_workers)
+    futures = [
+        pool.submit(_call_limited, function, kwargs, memory_limit_mb)
+        for function, kwargs in calls
+    ]
+
+    return [future.result() for future in futures]
+
+
+def _run_timed(
+    calls: list[tuple[Callable, dict[str, any]]],
+    timeout: float,
+    memory_limit_mb: int | None,
+    max_workers: int | None,
+) -> list[any]:
+    deadline = time.monotonic() + timeout
+    workers = min(len(calls), max_workers or os.cpu_count() or 1)
+
+    # Leaving the block terminates the pool, and with it a stuck call
+    with multiprocessing.Pool(workers) as pool:
+        results = [
+            pool.apply_async(_call_limited, (function, kwargs, memory_limit_mb))
+            for function, kwargs in calls
+        ]
+
+        try:
+            return [
+                result.get(max(0, deadline - time.monotonic())) for result in results
+            ]
+        except multiprocessing.TimeoutError:
+            raise TimeoutError(
+                f"Custom script timed out after {timeout} seconds."
+            ) from None
+
+
+def _pool(max_workers: int | None) -> ProcessPoolExecutor:
+    # Steps asking for different sizes get pools of their own, replacing the
+    # pool would abandon the calls other threads have just submitted to it
+    with _POOL_LOCK:
+        pool = _POOLS.get(max_workers)
+
+        if pool is None:
+            pool = _POOLS[max_workers] = ProcessPoolExecutor(max_workers=max_workers)
+
+        return pool
+
+
+def _call_limited(
+    function: Callable, kwargs: dict[str, any], memory_limit_mb: int | None
+) -> any:
+    if memory_limit_mb is None:
+        return function(**kwargs)
+
+    try:
+        import resource
+    except ImportError:
+        # No address space limit on Windows
+        return function(**kwargs)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = memory_limit_mb * 1024 * 1024
+
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+    try:
+        return function(**kwargs)
+    finally:
+        # Only the soft limit was lowered, the worker can restore it
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _map_vectorized(
+    expression: str, items: list[any], scope: dict[str, any], cache_dir: Path | None
+) -> list[any] | None:
+    """
+    Result of the expression over a NumPy array of the items, or None when the
+    items aren't all floats, NumPy isn't installed or the expression doesn't
+    work on arrays. Ints are left to the item by item path: NumPy would wrap
+    around on overflow, and turn them into floats when mixed with floats.
+    """
+    if not items or not all(type(item) is float for item in items):
+        return None
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    code = compile_script(expression, "eval", cache_dir)
+
+    try:
+        with numpy.errstate(all="raise"):
+            result = eval(code, {**scope, "np": numpy, "item": numpy.asarray(items)})
+    except (
+        ArithmeticError,
+        AttributeError,
+        LookupError,
+        NameError,
+        TypeError,
+        ValueError,
+    ):
+        # e.g. math functions or conditions on a single item, or a division by
+        # zero that must raise like in the item by item path
+        return None
+
+    if not isinstance(result, numpy.ndarray) or result.shape != (len(items),):
+        return None
+
+    return result.tolist()
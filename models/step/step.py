@@ -1,5 +1,11 @@
+import asyncio
 from enum import Enum
-from pydantic import BaseModel, ConfigDict
+from collections.abc import Callable
+from functools import partial
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from models.profiler import in_thread
+from models.step.parameter_resolver import compile_parameters, compile_reference
 
 
 class StepType(Enum):
@@ -18,12 +24,51 @@ class Step(BaseModel):
     description: str
     parameters: dict[str, any]
     parameter_paths: list[str] | None = None
+    depends_on: list[str] | None = None
+    skip_if: str | None = None  # output path, e.g. "check_session.valid"
+    cache: bool = False
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    # Compiled once per step, kept by the copies `CompiledStep.bind` hands out
+    _resolve_parameters: Callable[[dict[str, any]], dict[str, any]] = PrivateAttr()
+    _resolve_skip_if: Callable[[dict[str, any]], any] | None = PrivateAttr()
+
+    def model_post_init(self, context: any, /) -> None:
+        self._resolve_parameters = compile_parameters(
+            self.parameters, self.parameter_paths or []
+        )
+        self._resolve_skip_if = (
+            compile_reference(self.skip_if) if self.skip_if else None
+        )
+
     def execute(self):
         raise NotImplementedError("Execute method must be implemented in subclasses")
 
+    async def execute_async(self, *args):
+        """
+        Run `execute` on the event loop's default executor so blocking steps
+        don't stall the loop. Steps with a native async implementation override
+        this.
+        """
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, in_thread(partial(self.execute, *args)))
+
+    @property
+    def cacheable(self) -> bool:
+        """
+        Whether the output of the step can be served from the step result cache.
+        """
+        return True
+
+    def cache_key_data(self) -> dict[str, any]:
+        """
+        Everything the output of the step depends on, hashed into the step
+        result cache key. Called after `parse_parameters`.
+        """
+        return self.model_dump(include={"step_type", "action", "parameters"})
+
     @staticmethod
     def to_sample_dict() -> dict[str, any]:
         return {
@@ -32,8 +77,21 @@ class Step(BaseModel):
             "description": "A custom script step",
             "parameters": {},
             "parameter_paths": None,
+            "depends_on": None,
+            "skip_if": None,
+            "cache": False,
         }
 
+    def should_skip(self, total_steps_params: dict[str, any]) -> bool:
+        """
+        Whether the output pointed at by `skip_if` is truthy, e.g. to skip the
+        login steps when a CHECK_SESSION step found the session still valid.
+        """
+        if self._resolve_skip_if is None:
+            return False
+
+        return bool(self._resolve_skip_if(total_steps_params))
+
     def parse_parameters(self, total_steps_params: dict[str, any]):
         """
         This function is use for parsing parameter for each step.
@@ -53,40 +111,14 @@ class Step(BaseModel):
         If the selector field have the value of "extract_text_from_header.text",
         then the value will be extract from the output "text" of task "extract_text_from_header"
 
+        The value can also be a text with `${step.key}` placeholders, paths can
+        index lists (`step.records[0].title`) and end with a `|default` (see
+        `models.step.parameter_resolver`). The references are compiled when the
+        step is validated, and the resolved parameters share everything that
+        isn't resolved with the step's template.
+
         :param self:
         :param total_steps_params: The entire output for all the step for the recipe.
         :type total_steps_params: dict[str, any]
         """
-        if not self.parameter_paths:
-            return
-
-        for path in self.parameter_paths:
-            keys = path.split(".")
-
-            value = self.parameters
-
-            last_key = keys.pop()
-
-            value = get_value_from_path(value, keys)
-
-            parse_value = get_value_from_path(
-                total_steps_params, value[last_key].split(".")
-            )
-
-            value[last_key] = parse_value
-
-
-def get_value_from_path(data: dict[str, any], keys: list[str]) -> any:
-    # Empty keys return whole object
-    if not keys:
-        return data
-
-    value = data
-    full_path = ".".join(keys)
-
-    for key in keys:
-        if key not in value:
-            raise KeyError(f"Key '{key}' not found while accessing path '{full_path}'")
-        value = value[key]
-
-    return value
+        self.parameters = self._resolve_parameters(total_steps_params)
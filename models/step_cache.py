@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import time
+from collections.abc import Iterable
+from logging import Logger
+from pathlib import Path
+from threading import Lock
+
+from pydantic import BaseModel
+
+from models.step.step import Step
+from models.store import get_store_dir
+
+STEP_CACHE_DIRNAME = "homecook_step_cache"
+
+
+class StepCacheConfig(BaseModel):
+    cache_dir: Path | None = None  # defaults to the store directory
+    max_size_mb: int = 512
+    ttl: int = 7 * 24 * 3600  # in seconds
+
+    @staticmethod
+    def to_sample_dict() -> dict[str, any]:
+        return {"cache_dir": None, "max_size_mb": 512, "ttl": 7 * 24 * 3600}
+
+
+class StepCache:
+    """
+    On-disk cache of step outputs for the steps with `cache: true`.
+
+    Entries are keyed on the step's `cache_key_data` (step type, action,
+    resolved parameters and content hashes of its input files). Expired entries
+    and, once the cache outgrows `max_size_mb`, the least recently used ones
+    are evicted.
+    """
+
+    def __init__(self, config: StepCacheConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+        self.cache_dir = (
+            Path(config.cache_dir)
+            if config.cache_dir
+            else get_store_dir() / STEP_CACHE_DIRNAME
+        )
+        self._lock = Lock()
+
+    def key(self, step: Step) -> str:
+        content = json.dumps(step.cache_key_data(), sort_keys=True, default=str)
+
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> tuple[bool, any]:
+        """
+        Return whether the key was found and its recorded output.
+        """
+        path = self._entry_path(key)
+
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False, None
+
+        if time.time() - entry["created_at"] > self.config.ttl:
+            path.unlink(missing_ok=True)
+            return False, None
+
+        # The modification time records the last access for the LRU eviction
+        os.utime(path)
+
+        return True, entry["result"]
+
+    def put(self, key: str, result: any) -> None:
+        try:
+            content = json.dumps({"created_at": time.time(), "result": result})
+        except TypeError as e:
+            self.logger.warning(f"Step output can't be cached: {e}")
+            return
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        path = self._entry_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+
+        with open(tmp_path, "w") as f:
+            f.write(content)
+
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            evict_lru_files(
+                self.cache_dir.glob("*.json"),
+                max_size=self.config.max_size_mb * 1024 * 1024,
+                ttl=self.config.ttl,
+            )
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+
+def evict_lru_files(paths: Iterable[Path], max_size: int, ttl: float) -> None:
+    """
+    Delete the cache entry files not accessed for `ttl` seconds, then the least
+    recently accessed ones until they fit in `max_size` bytes. The modification
+    time of an entry records its last access.
+    """
+    now = time.time()
+    entries: list[tuple[float, int, Path]] = []
+
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+
+        # Entries are never rewritten, so one not accessed for `ttl` has
+        # expired too
+        if now - stat.st_mtime > ttl:
+            path.unlink(missing_ok=True)
+            continue
+
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+
+        path.unlink(missing_ok=True)
+        total_size -= size
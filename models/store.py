@@ -53,9 +53,7 @@ def load_recipe_store(logger: Logger) -> TOMLDocument:
     global RECIPES_STORE
     global RECIPES_STORE_PATH
 
-    base_store_dir = os.getenv("HOMECOOK_STORE_DIR", str(Path.home()))
-
-    recipes_store = Path(base_store_dir).joinpath(RECIPES_STORE_FILENAME)
+    recipes_store = get_store_dir().joinpath(RECIPES_STORE_FILENAME)
     RECIPES_STORE_PATH = recipes_store
 
     logger.info(f"Using recipe store at: {recipes_store}")
@@ -71,6 +69,13 @@ def load_recipe_store(logger: Logger) -> TOMLDocument:
             RECIPES_STORE = parse(content)
 
 
+def get_store_dir() -> Path:
+    """
+    Directory holding the recipes store and the other HomeCook state files.
+    """
+    return Path(os.getenv("HOMECOOK_STORE_DIR", str(Path.home())))
+
+
 def create_base_recipe_store() -> TOMLDocument:
     doc = document()
     doc.add(comment(" HomeCook Recipes Store "))
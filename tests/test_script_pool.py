@@ -0,0 +1,42 @@
+import logging
+
+from models.step.custom_step import CustomStep
+from models.step.script_pool import evaluate_script, run_in_process
+
+
+def test_exec_scripts_state_does_not_leak_between_runs():
+    exec_scripts = ["seen = []"]
+    script = "seen.append(params[0]) or seen"
+
+    assert evaluate_script(script, exec_scripts, [1]) == [1]
+    assert evaluate_script(script, exec_scripts, [2]) == [2]
+
+
+def test_prepared_scopes_are_shared_when_enabled():
+    exec_scripts = ["shared = []"]
+    script = "shared.append(params[0]) or len(shared)"
+
+    first = evaluate_script(script, exec_scripts, [1], prepared_scopes=True)
+    second = evaluate_script(script, exec_scripts, [2], prepared_scopes=True)
+
+    assert second == first + 1
+
+
+def test_run_in_process_without_calls():
+    assert run_in_process([], timeout=2) == []
+    assert run_in_process([]) == []
+
+
+def test_timed_process_map_of_no_items():
+    step = CustomStep(
+        name="map",
+        step_type="CUSTOM_SCRIPT",
+        description="map nothing",
+        action="MAP",
+        parameters={"items": [], "expression": "item * 2"},
+        executor="PROCESS",
+        timeout=2,
+        logger=logging.getLogger(),
+    )
+
+    assert step.execute() == {"result": []}